@@ -0,0 +1,203 @@
+"""
+Benchmark of the TreeViz build stages on synthetic funnels.
+
+Usage:
+    python -m funnel_tree_vis.benchmark_funnel_viz --depth 3 --fan-out 4 8 16 --n-row 100000
+
+Each stage is timed separately and the peak memory of a whole build is measured with
+tracemalloc. When more than one configuration is run, the scaling exponent of each stage
+with the number of node is printed (1 is linear, 2 is quadratic), --max-exponent makes the
+script fail if a stage grows faster than that.
+"""
+from __future__ import division
+
+import argparse
+import sys
+import time
+import tracemalloc
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from .funnel_viz import TreeViz
+
+
+STAGE_LIST = ['init', '_get_all_node_df', '_create_tree_structure',
+              '_set_node_metric_and_calculation', 'to_dot']
+
+
+def gen_funnel_df(depth=3, fan_out=5, n_metric=2, n_row=10000, seed=0):
+    """
+    Function that generate a synthetic funnel, the rows are spread at random on the leaves.
+
+    :param depth: Number of level of the funnel
+    :param fan_out: Number of value of each level
+    :param n_metric: Number of metric column
+    :param n_row: Number of row
+    :param seed: Seed of the random generator
+    :return: Pandas DataFrame with the columns level_0..level_{depth-1}, metric_0..metric_{n_metric-1}
+    """
+    random_state = np.random.RandomState(seed)
+    df = pd.DataFrame({'level_{}'.format(i):
+                       np.char.add('value_{}_'.format(i),
+                                   random_state.randint(0, fan_out, n_row).astype(str))
+                       for i in range(depth)})
+    for i in range(n_metric):
+        df['metric_{}'.format(i)] = random_state.randint(1, 1000, n_row)
+    return df
+
+
+def gen_calculations(n_calculation=1, n_metric=2):
+    """
+    Function that generate ratios of metrics, each calculation after the first one also
+    depends on the previous calculation.
+
+    :param n_calculation: Number of calculation
+    :param n_metric: Number of metric column of the funnel
+    :return: A dict with key='calculation name' and value = Function to be applied on each node.
+    """
+    calculations = {}
+    for i in range(n_calculation):
+        numerator = 'metric_{}'.format((i + 1) % n_metric)
+        denominator = 'metric_{}'.format(i % n_metric)
+        if i == 0:
+            calculations['calculation_0'] = \
+                lambda df, numerator=numerator, denominator=denominator: \
+                df[numerator] / df[denominator]
+        else:
+            calculations['calculation_{}'.format(i)] = \
+                lambda df, numerator=numerator, denominator=denominator, i=i: \
+                df[numerator] / df[denominator] + df['calculation_{}'.format(i - 1)]
+    return calculations
+
+
+def _build_by_stage(df, calculations):
+    """
+    Function that build the tree like TreeViz.tree, timing each stage.
+
+    :return: dict {stage: seconds} and the number of node
+    """
+    timing_dict = {}
+
+    start = time.perf_counter()
+    tree_viz = TreeViz(df, calculations=calculations)
+    timing_dict['init'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_all_node = tree_viz._get_all_node_df()
+    timing_dict['_get_all_node_df'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree = tree_viz._create_tree_structure(df_all_node, tree_viz.metrics)
+    timing_dict['_create_tree_structure'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree_viz._set_node_metric_and_calculation(df_all_node, tree)
+    tree_viz._add_calculation_to_node(tree, tree_viz.calculations)
+    timing_dict['_set_node_metric_and_calculation'] = time.perf_counter() - start
+
+    # to_dot is the DOT generation of plot_tree, without the graphviz rendering
+    tree_viz._tree = tree
+    start = time.perf_counter()
+    tree_viz.to_dot(edge_prop_metric=tree_viz.metrics[0])
+    timing_dict['to_dot'] = time.perf_counter() - start
+
+    return timing_dict, len(df_all_node)
+
+
+def benchmark_tree_viz(depth=3, fan_out=5, n_metric=2, n_calculation=1, n_row=10000,
+                       repeat=3):
+    """
+    Function that time each stage of the build of a synthetic funnel.
+
+    :param repeat: Number of build, the best time of each stage is kept
+    :return: dict with the parameters, the number of node, the seconds of each stage
+        and the peak memory in MB
+    """
+    df = gen_funnel_df(depth, fan_out, n_metric, n_row)
+    calculations = gen_calculations(n_calculation, n_metric)
+
+    timing_dict_list = []
+    for _ in range(repeat):
+        timing_dict, n_node = _build_by_stage(df, calculations)
+        timing_dict_list.append(timing_dict)
+
+    # tracemalloc slows down the build, the peak memory is measured on a separate build
+    tracemalloc.start()
+    _build_by_stage(df, calculations)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result_dict = {'depth': depth, 'fan_out': fan_out, 'n_metric': n_metric,
+                   'n_calculation': n_calculation, 'n_row': n_row, 'n_node': n_node}
+    for stage in STAGE_LIST:
+        result_dict[stage] = min(timing_dict[stage] for timing_dict in timing_dict_list)
+    result_dict['peak_memory_mb'] = peak_memory / 1024 ** 2
+    return result_dict
+
+
+def run_benchmark(depth_list=(3,), fan_out_list=(4, 8, 16), n_metric_list=(2,),
+                  n_calculation_list=(1,), n_row_list=(10000,), repeat=3):
+    """
+    Function that run benchmark_tree_viz on every combination of the parameters.
+
+    :return: Pandas DataFrame with one row per combination
+    """
+    return pd.DataFrame([benchmark_tree_viz(depth, fan_out, n_metric, n_calculation, n_row,
+                                            repeat)
+                         for depth, fan_out, n_metric, n_calculation, n_row in
+                         product(depth_list, fan_out_list, n_metric_list,
+                                 n_calculation_list, n_row_list)])
+
+
+def get_scaling_exponent(df_result, size_column='n_node'):
+    """
+    Function that fit time = a * size ** exponent for each stage (slope in log-log).
+
+    :param df_result: Pandas DataFrame coming from run_benchmark
+    :param size_column: Column of the size of the problem
+    :return: dict {stage: exponent}
+    """
+    log_size = np.log(df_result[size_column].astype(float))
+    return {stage: np.polyfit(log_size, np.log(df_result[stage]), 1)[0] for stage in STAGE_LIST}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TreeViz build stages")
+    parser.add_argument('--depth', type=int, nargs='+', default=[3])
+    parser.add_argument('--fan-out', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--n-metric', type=int, nargs='+', default=[2])
+    parser.add_argument('--n-calculation', type=int, nargs='+', default=[1])
+    parser.add_argument('--n-row', type=int, nargs='+', default=[10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--size-column', default='n_node',
+                        help="Column used for the scaling exponent: n_node or n_row")
+    parser.add_argument('--max-exponent', type=float, default=None,
+                        help="Fail if a stage scales faster than size ** max_exponent")
+    args = parser.parse_args(argv)
+
+    df_result = run_benchmark(args.depth, args.fan_out, args.n_metric, args.n_calculation,
+                              args.n_row, args.repeat)
+    print(df_result.to_string(index=False, float_format='{:.4f}'.format))
+
+    if df_result[args.size_column].nunique() < 2:
+        return 0
+
+    exponent_dict = get_scaling_exponent(df_result, args.size_column)
+    print("\nScaling exponent with {}:".format(args.size_column))
+    for stage, exponent in exponent_dict.items():
+        print("    {stage}: {exponent:.2f}".format(stage=stage, exponent=exponent))
+
+    if args.max_exponent is not None:
+        too_slow_list = [stage for stage, exponent in exponent_dict.items()
+                         if exponent > args.max_exponent]
+        if too_slow_list:
+            print("\nStage(s) scaling faster than {}: {}".format(args.max_exponent,
+                                                                 too_slow_list))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
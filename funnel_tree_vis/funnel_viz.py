@@ -1,11 +1,30 @@
 from __future__ import division
 
+import hashlib
+import io
+import json
 import os
+import re
+import shutil
+import subprocess
+import tempfile
+import types
+import uuid
+from collections import namedtuple
+from functools import partial
+from itertools import chain, islice
+from multiprocessing import Pool, cpu_count
 import pandas as pd
 import numpy as np
 from PIL import Image
 from anytree import Node as BaseNode, PreOrderIter
-from anytree.dotexport import RenderTreeGraph
+
+
+DOT_INDENT = '    '
+_RE_DOT_ESCAPE = re.compile(r'(["\\])')
+NODE_TABLE_CACHE_VERSION = 2
+# plotly.graph_objs class of each kind of to_plotly, Icicle needs plotly>=4.14
+PLOTLY_KIND_DICT = {'sunburst': 'Sunburst', 'treemap': 'Treemap', 'icicle': 'Icicle'}
 
 
 class Node(BaseNode):
@@ -22,6 +41,8 @@ class Node(BaseNode):
         self.metrics = metrics
         self.node_name_print = self.name.split('->')[-1] if name != 'root' else 'Total'
         self.calculation = {}
+        # {'metric or calculation name': np.array of one value per snapshot}
+        self.snapshot_values = {}
 
     def __getattr__(self, name):
         """
@@ -42,7 +63,62 @@ class Node(BaseNode):
             Helper function to add/update a calculation in the dict
             :param calculation_dict: A dict with key='calculation name' and value = Function to be applied on each node.
         """
-        self.calculation.update(calculation_dict)
+        self.calculation = dict(self.calculation, **calculation_dict)
+
+    @property
+    def materialized_children(self):
+        """
+        Children already created, same as children for a Node()
+        """
+        return self.children
+
+
+class LazyNode(Node):
+    """
+    Node() whose children are created the first time they are accessed.
+    """
+    def __init__(self, name, metrics, parent=None, expand_func=None):
+        """
+        :param name: string representing the name of the node
+        :param metrics: List of string representing all the metrics to be aggregated on each node
+        :param parent: Node() object representing the parent (there is a parent)
+        :param expand_func: Function creating the children of the node, called with the node.
+            If None, the node is already expanded.
+        """
+        # Set before the parent is attached in case anytree looks at the children
+        self._expand_func = expand_func
+        self.is_expanded = expand_func is None
+        super(LazyNode, self).__init__(name, metrics, parent)
+
+    @property
+    def children(self):
+        return self.expand()
+
+    @children.setter
+    def children(self, children):
+        BaseNode.children.fset(self, children)
+
+    @children.deleter
+    def children(self):
+        BaseNode.children.fdel(self)
+
+    @property
+    def materialized_children(self):
+        """
+        Children already created, the node is not expanded
+        """
+        return BaseNode.children.fget(self)
+
+    def expand(self):
+        """
+        Function that create the children of the node if they are not created yet
+
+        :return: Tuple of the children
+        """
+        if not self.is_expanded:
+            self.is_expanded = True
+            self._expand_func(self)
+        return BaseNode.children.fget(self)
 
 
 class TreeViz(object):
@@ -51,22 +127,65 @@ class TreeViz(object):
     """
     SEP = '->'
     root_name = 'root'
+    other_name = 'Other'
 
-    def __init__(self, df, node_level_list=None, metrics=None, calculations=None):
+    def __init__(self, df, node_level_list=None, metrics=None, calculations=None,
+                 top_k=None, min_share=None, prune_metric=None, max_depth=None, other_name=None,
+                 snapshot_by=None, base_snapshot=None, cache_dir=None, lazy_depth=None):
         """
         :param df: Pandas DataFrame with some key and metric column
         :param node_level_list: Column of the DataFrame on which we will create the tree structure
         :param metrics: Column of the Dataframe on which we will aggregate the value on a node
             level.
+        :param top_k: Keep only the top_k children of each node, the rest is folded in 'Other'
+        :param min_share: Keep only the children having at least this share of their parent
+            prune_metric, the rest is folded in 'Other'
+        :param prune_metric: Metric used to rank the children, default to the first metric
+        :param max_depth: Maximum number of level of node_level_list to show in the tree, at least 1
+            (a ValueError is raised otherwise), None shows every level
+        :param other_name: Label of the node holding the folded children, default to 'Other'
+        :param snapshot_by: Column of the DataFrame splitting the data in snapshots (weeks,
+            experiment arms...). The nodes hold the total and one value per snapshot.
+        :param base_snapshot: Snapshot to which the other ones are compared in the labels,
+            default to the first snapshot
+        :param cache_dir: Directory where the node table is saved and reloaded from,
+            an entry is rebuilt when the data or the calculations changed. The data is only
+            aggregated when an entry is rebuilt. The cache is not used when a calculation can't
+            be hashed (callable objects, bound methods...)
+        :param lazy_depth: If not None, only the nodes of the first lazy_depth levels are created,
+            the children of the other nodes are created when they are first accessed
         """
-        self.df = df.copy()
+        # Column splitting the data in snapshots, it is never a node level nor a metric
+        self.snapshot_by = snapshot_by
+        self.base_snapshot = base_snapshot
+        self.snapshot_list = []
+        key_list = self._key_list
+
+        # from_file gives a _LeafSource with the node levels and the metrics, the file is only
+        # read if its node tables are not found in cache_dir
+        is_leaf_source = isinstance(df, _LeafSource)
+        if is_leaf_source and not (node_level_list and metrics):
+            raise ValueError("node_level_list and metrics are needed to read the data later")
 
         # If node_level_list is None, every column that are not considered as a number are taken
         self.node_level_list = node_level_list or \
-                                list(df.select_dtypes(exclude=[np.number]).columns.values)
+            self._get_default_node_level_list(df, key_list)
 
         # If metrics is None, every column that are considered as a number are taken
-        self.metrics = metrics or list(df.select_dtypes(include=[np.number]).columns.values)
+        self.metrics = metrics or self._get_default_metrics(df, key_list)
+
+        # Only the leaf aggregates are kept, not the raw data, see the df property.
+        # With cache_dir the raw data is fingerprinted instead of aggregated right away.
+        if not is_leaf_source:
+            self._check_snapshot(df)
+            self._check_base_snapshot(None if snapshot_by is None else df[snapshot_by])
+            df = _LeafSource(partial(aggregate_chunks, [df], key_list + self.node_level_list,
+                                     self.metrics, processes=1),
+                             None if cache_dir is None else
+                             _hash_df(df, key_list + self.node_level_list + self.metrics))
+        self._aggregate_func = df.aggregate_func
+        self._source_fingerprint = df.fingerprint
+        self._df = None
 
         # Calculation to be added to the node
         self.calculations = {} if not calculations else calculations
@@ -75,17 +194,391 @@ class TreeViz(object):
         #  to be printed : {'metric_name': {'type': type, 'digits': digits}}
         self._node_metric_col_print_dict = {}
 
+        # Pruning applied on the aggregate table before the tree is created,
+        # max_depth is None (every level) or at least 1
+        self.prune_dict = {'top_k': top_k, 'min_share': min_share,
+                           'prune_metric': prune_metric, 'max_depth': max_depth}
+        self._check_prune_dict(self.prune_dict)
+        self.other_name = other_name or self.other_name
+
+        # Leaf level aggregates of the rows received through update()
+        self._delta_df_list = []
+
+        # On-disk cache of the node table, see _get_cached_all_node_df
+        self.cache_dir = cache_dir
+
+        # Number of level created when the tree is built, see _build_lazy_tree
+        self.lazy_depth = lazy_depth
+
+        # The tree is built once and kept up to date by update(): {node_name: Node()}
+        self._tree = None
+        self._node_dict = {}
+
+        # Without cache the leaf aggregates are always needed
+        if cache_dir is None:
+            self.df
+
+    @classmethod
+    def from_chunks(cls, chunks, node_level_list=None, metrics=None, processes=None, **kwargs):
+        """
+        Function that create a TreeViz from data that doesn't fit in memory. Each chunk is
+        aggregated to the leaf level on a process pool and the partial aggregates are merged,
+        the raw data is never kept.
+
+        :param chunks: Iterable of Pandas DataFrame with the same columns
+        :param node_level_list: Column of the DataFrame on which we will create the tree
+            structure, inferred from the first chunk if None
+        :param metrics: Column of the Dataframe on which we will aggregate the value on a node
+            level, inferred from the first chunk if None
+        :param processes: Number of processes of the pool, default to the number of cpu.
+            With processes=1 the chunks are aggregated in this process.
+        :param kwargs: Other parameters of TreeViz()
+        :return: TreeViz() object
+        """
+        chunk_iter = iter(chunks)
+        first_chunk = next(chunk_iter, None)
+        if first_chunk is None:
+            raise ValueError("chunks should contain at least one DataFrame")
+
+        key_list = [] if kwargs.get('snapshot_by') is None else [kwargs['snapshot_by']]
+        node_level_list = node_level_list or \
+            cls._get_default_node_level_list(first_chunk, key_list)
+        metrics = metrics or cls._get_default_metrics(first_chunk, key_list)
+
+        df_leaf = aggregate_chunks(chain([first_chunk], chunk_iter),
+                                   key_list + node_level_list, metrics, processes)
+        return cls(df_leaf, node_level_list, metrics, **kwargs)
+
+    @classmethod
+    def from_file(cls, filepath, chunksize=100000, node_level_list=None, metrics=None,
+                  processes=None, **kwargs):
+        """
+        Function that create a TreeViz from a CSV or Parquet file, read by chunk of chunksize
+        rows. See from_chunks for the other parameters.
+        With cache_dir, the file is identified by its path, size and modification time and
+        is only read when its node tables are not in the cache.
+
+        :param filepath: Path of a .csv or .parquet file
+        :param chunksize: Number of rows read at once
+        :return: TreeViz() object
+        """
+        key_list = [] if kwargs.get('snapshot_by') is None else [kwargs['snapshot_by']]
+        column_list = key_list + node_level_list + metrics if node_level_list and metrics \
+            else None
+        if kwargs.get('cache_dir') is None:
+            return cls.from_chunks(_read_file_chunks(filepath, chunksize, column_list),
+                                   node_level_list, metrics, processes, **kwargs)
+
+        # With cache_dir the file is fingerprinted by its path, size and modification time,
+        # it is only aggregated if its node tables are not found in the cache.
+        # Only the first chunk is read to infer the missing node levels or metrics.
+        _check_file_extension(filepath)
+        if column_list is None:
+            chunks = _read_file_chunks(filepath, chunksize)
+            first_chunk = next(iter(chunks), None)
+            chunks.close()
+            if first_chunk is None:
+                raise ValueError("chunks should contain at least one DataFrame")
+            node_level_list = node_level_list or \
+                cls._get_default_node_level_list(first_chunk, key_list)
+            metrics = metrics or cls._get_default_metrics(first_chunk, key_list)
+            column_list = key_list + node_level_list + metrics
+
+        file_stat = os.stat(filepath)
+        fingerprint = hashlib.sha1(json.dumps(
+            [os.path.abspath(filepath), file_stat.st_size, file_stat.st_mtime,
+             [str(column) for column in column_list]]).encode('utf-8')).hexdigest()
+        aggregate_func = partial(_aggregate_file, filepath, chunksize, column_list,
+                                 key_list + node_level_list, metrics, processes)
+        return cls(_LeafSource(aggregate_func, fingerprint), node_level_list, metrics, **kwargs)
+
+    @staticmethod
+    def _get_default_node_level_list(df, key_list):
+        return [column for column in df.select_dtypes(exclude=[np.number]).columns.values
+                if column not in key_list]
+
+    @staticmethod
+    def _get_default_metrics(df, key_list):
+        return [column for column in df.select_dtypes(include=[np.number]).columns.values
+                if column not in key_list]
+
+    @property
+    def df(self):
+        """
+        Leaf level aggregates of the data. With cache_dir the data is aggregated the first time
+        it is needed, so never when the node tables are found in the cache.
+        """
+        if self._df is None:
+            df = self._aggregate_func()
+            self._check_snapshot(df)
+            self._check_base_snapshot(None if self.snapshot_by is None else df[self.snapshot_by])
+            # The raw data is not kept once aggregated
+            self._df, self._aggregate_func = df, None
+        return self._df
+
     @property
     def tree(self):
         """
         Create the tree, set the node value and add calculation
         """
-        df_all_node = self._get_all_node_df()
+        if self._tree is None:
+            self._tree = self._build_tree(**self.prune_dict)
+            self._node_dict = {node.name: node for node in _iter_materialized(self._tree)}
+        return self._tree
+
+    def _build_tree(self, top_k=None, min_share=None, prune_metric=None, max_depth=None):
+        """
+        Function that create the tree from the data, see _prune_leaf_df for the parameters
+
+        :return: Node() object of the root
+        """
+        if self.snapshot_by is None:
+            df_all_node = self._get_cached_all_node_df(top_k, min_share, prune_metric, max_depth)
+        else:
+            # A single aggregation by (snapshot, node), the total of each node is
+            # computed from it instead of going back to the data
+            df_snapshot_node = self._get_cached_all_node_df(top_k, min_share, prune_metric,
+                                                            max_depth, snapshot_by=self.snapshot_by)
+            df_all_node = df_snapshot_node.groupby('node_name', as_index=False)[self.metrics].sum()
+            df_all_node = self._apply_calculations(df_all_node, self.calculations)
+
+        if self.lazy_depth is not None:
+            return self._build_lazy_tree(
+                df_all_node, None if self.snapshot_by is None else df_snapshot_node)
+
         tree = self._create_tree_structure(df_all_node, self.metrics)
         tree = self._set_node_metric_and_calculation(df_all_node, tree)
         self._add_calculation_to_node(tree, self.calculations)
+
+        if self.snapshot_by is not None:
+            self._set_node_snapshot_values(df_snapshot_node, tree)
         return tree
 
+    def _get_cached_all_node_df(self, top_k=None, min_share=None, prune_metric=None,
+                                max_depth=None, snapshot_by=None):
+        """
+        Function that return _get_all_node_df from cache_dir when the entry is up to date,
+        otherwise compute it and save it in cache_dir. Without cache_dir it is the same as
+        _get_all_node_df.
+
+        The entry of a node table is keyed by node_level_list, metrics, calculation names,
+        pruning and snapshot_by. It is stale when the fingerprint of the data or of the
+        calculations changed. The cache is not used when a calculation can't be fingerprinted.
+        """
+        fingerprint = None if self.cache_dir is None else self.fingerprint
+        if fingerprint is None:
+            return self._get_all_node_df(top_k, min_share, prune_metric, max_depth, snapshot_by)
+
+        config_dict = {'node_level_list': self.node_level_list, 'metrics': self.metrics,
+                       'calculations': list(self.calculations.keys()),
+                       'prune_dict': {'top_k': top_k, 'min_share': min_share,
+                                      'prune_metric': prune_metric, 'max_depth': max_depth},
+                       'snapshot_by': snapshot_by,
+                       'names': [self.SEP, self.root_name, self.other_name]}
+        cache_key = hashlib.sha1(
+            json.dumps(config_dict, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        cache_path = os.path.join(self.cache_dir, cache_key[:16])
+
+        df_all_node, metadata = load_node_table(cache_path, fingerprint)
+        if df_all_node is not None:
+            # Like _get_all_node_df, only the table by snapshot sets snapshot_list
+            if snapshot_by is not None:
+                self.snapshot_list = metadata['snapshot_list']
+                self._check_base_snapshot(self.snapshot_list)
+            return df_all_node
+
+        df_all_node = self._get_all_node_df(top_k, min_share, prune_metric, max_depth, snapshot_by)
+        save_node_table(df_all_node, cache_path, dict(config_dict, fingerprint=fingerprint),
+                        self.SEP, None if snapshot_by is None else self.snapshot_list)
+        return df_all_node
+
+    @property
+    def fingerprint(self):
+        """
+        Hash of the data and of the calculations. The data is the raw data (or the file) when
+        cache_dir is set, otherwise the leaf aggregates, plus the update() deltas. The
+        calculations are hashed with their code, default values, closure cells and the globals
+        they use, see _update_hash. None if a calculation can't be hashed reliably.
+        """
+        sha1 = hashlib.sha1()
+        sha1.update((self._source_fingerprint or _hash_df(self.df)).encode('utf-8'))
+        for df in self._delta_df_list:
+            sha1.update(_hash_df(df).encode('utf-8'))
+        for calculation_name, calculation in self.calculations.items():
+            sha1.update(calculation_name.encode('utf-8'))
+            if not _update_hash(sha1, calculation):
+                return None
+        return sha1.hexdigest()
+
+    def _build_lazy_tree(self, df_all_node, df_snapshot_node=None):
+        """
+        Function that create only the nodes of the first lazy_depth levels. The nodes of the
+        last level are LazyNode() whose children are created from df_all_node when they are
+        first accessed, see _expand_node.
+
+        :param df_all_node: Pandas DataFrame coming from _get_all_node_df
+        :param df_snapshot_node: Pandas DataFrame coming from _get_all_node_df(snapshot_by=...)
+        :return: Node() object of the root
+        """
+        # The children of a node are found with a binary search on the sorted parent ids,
+        # the node names are unique so the id of a node is its position in df_all_node
+        parent_id_array = _get_parent_id(df_all_node['node_name'], self.SEP)
+        child_position_array = np.argsort(parent_id_array, kind='stable')
+        lazy_table = {'df': df_all_node,
+                      'node_name_index': pd.Index(df_all_node['node_name']),
+                      'parent_id_array': parent_id_array[child_position_array],
+                      'child_position_array': child_position_array,
+                      'snapshot_matrix_dict': None if df_snapshot_node is None else
+                      self._get_snapshot_matrix_dict(df_snapshot_node)}
+
+        depth_array = df_all_node['node_name'].str.count(re.escape(self.SEP)).values
+        top_position_array = np.flatnonzero(depth_array <= self.lazy_depth)
+        df_top_node = df_all_node.iloc[top_position_array]
+
+        tree = self._create_tree_structure(df_top_node, self.metrics,
+                                           partial(self._expand_node, lazy_table), self.lazy_depth)
+        tree = self._set_node_metric_and_calculation(df_top_node, tree)
+        self._add_calculation_to_node(tree, self.calculations)
+        if df_snapshot_node is not None:
+            node_dict = {node.name: node for node in _iter_materialized(tree)}
+            self._set_snapshot_values_by_position(
+                [node_dict[node_name] for node_name in df_top_node['node_name'].values],
+                top_position_array, lazy_table['snapshot_matrix_dict'])
+        return tree
+
+    def _expand_node(self, lazy_table, node):
+        """
+        Function that create the children of a LazyNode() from the node table.
+
+        :param lazy_table: Dict created by _build_lazy_tree
+        :param node: LazyNode() to expand
+        """
+        parent_id_array = lazy_table['parent_id_array']
+        node_id = lazy_table['node_name_index'].get_loc(node.name)
+        start = np.searchsorted(parent_id_array, node_id, side='left')
+        end = np.searchsorted(parent_id_array, node_id, side='right')
+        position_array = lazy_table['child_position_array'][start:end]
+        df_child = lazy_table['df'].iloc[position_array]
+
+        expand_func = partial(self._expand_node, lazy_table)
+        child_list = []
+        for node_name in df_child['node_name'].values:
+            child = LazyNode(node_name, self.metrics, node, expand_func)
+            child.calculation = node.calculation
+            child_list.append(child)
+
+        self._set_node_metric_and_calculation(df_child, node)
+        if lazy_table['snapshot_matrix_dict'] is not None:
+            self._set_snapshot_values_by_position(child_list, position_array,
+                                                  lazy_table['snapshot_matrix_dict'])
+
+    def expand(self, node_name):
+        """
+        Function that return the node node_name, the lazy nodes on its path are expanded.
+
+        :param node_name: name of the node, for example 'root->A->B'
+        :return: Node() object
+        """
+        node = self.tree
+        # cumulative_names_from_right goes from the node to the root, which is already known
+        for name in reversed(self.cumulative_names_from_right(node_name)[:-1]):
+            child_list = [child for child in node.children if child.name == name]
+            if not child_list:
+                raise KeyError("Node '{}' not in the tree".format(name))
+            node = child_list[0]
+        return node
+
+    def _check_snapshot(self, df):
+        """
+        Function that raise a ValueError if some rows have no snapshot, they would be
+        missing from every node.
+
+        :param df: Pandas DataFrame with the snapshot_by column
+        """
+        if self.snapshot_by is not None and df[self.snapshot_by].isna().any():
+            raise ValueError("snapshot_by column {snapshot_by!r} has missing values".format(
+                snapshot_by=self.snapshot_by))
+
+    def _check_base_snapshot(self, snapshot_values):
+        """
+        Function that raise a ValueError if base_snapshot is set and is not a snapshot.
+
+        :param snapshot_values: Values of the snapshot_by column or snapshot_list,
+            None without snapshot_by
+        """
+        if self.base_snapshot is not None and \
+                (self.snapshot_by is None or
+                 not (pd.Series(snapshot_values) == self.base_snapshot).any()):
+            raise ValueError("base_snapshot {base_snapshot!r} is not a value of snapshot_by "
+                             "column {snapshot_by!r}".format(base_snapshot=self.base_snapshot,
+                                                             snapshot_by=self.snapshot_by))
+
+    @property
+    def _key_list(self):
+        """
+        Column that are aggregated with the node levels without being part of the tree
+        """
+        return [] if self.snapshot_by is None else [self.snapshot_by]
+
+    def update(self, delta_df):
+        """
+        Function that add new rows to the tree without rebuilding it.
+        The rows are aggregated to their leaf, the sums are added to the leaf and its ancestors,
+        the missing nodes are created and the calculations are recomputed for the touched nodes only.
+
+        :param delta_df: Pandas DataFrame with the same key and metric column as the original one
+        :return: self
+        """
+        key_list = self._key_list
+        self._check_snapshot(delta_df)
+        df_delta = delta_df[key_list + self.node_level_list + self.metrics]\
+            .groupby(key_list + self.node_level_list, as_index=False).sum()
+        self._delta_df_list.append(df_delta)
+
+        # Nothing to update if the tree has not been built yet,
+        # the delta will be picked up by _get_all_node_df().
+        # With pruning the delta can change which children are folded in 'Other',
+        # and with snapshots it can add a snapshot, so the tree is rebuilt on the next access.
+        # A lazy tree doesn't know the nodes that are not expanded yet, it is rebuilt as well.
+        if self._tree is None or self._is_pruned(**self.prune_dict) or key_list or \
+                self.lazy_depth is not None:
+            self._tree = None
+            return self
+
+        touched_node_dict = {}
+        n_level = len(self.node_level_list)
+        # One array per column so the metrics keep their numpy type, like in the rebuilt tree
+        for row in zip(*[df_delta[column].to_numpy()
+                         for column in self.node_level_list + self.metrics]):
+            path_string = self.SEP.join([self.root_name] + [str(value) for value in row[:n_level]])
+            # cumulative_names_from_right goes from the leaf to the root,
+            # we reverse it so the parent is always created before the child
+            for node_name in reversed(self.cumulative_names_from_right(path_string)):
+                node = self._node_dict.get(node_name)
+                if node is None:
+                    parent_node = self._node_dict[node_name.rsplit(self.SEP, 1)[0]]
+                    node = Node(node_name, self.metrics, parent_node)
+                    node.calculation = self._tree.calculation
+                    for metric in self.metrics:
+                        node.__setattr__(metric, 0)
+                    self._node_dict[node_name] = node
+                for metric, value in zip(self.metrics, row[n_level:]):
+                    node.__setattr__(metric, node.__getattr__(metric) + value)
+                touched_node_dict[node_name] = node
+
+        if self.calculations:
+            df_touched = pd.DataFrame(
+                [[node_name] + [node.__getattr__(metric) for metric in self.metrics]
+                 for node_name, node in touched_node_dict.items()],
+                columns=['node_name'] + self.metrics)
+            df_touched = self._apply_calculations(df_touched, self.calculations)
+            calculation_list = list(self.calculations.keys())
+            # One array per column so the values keep their numpy type (0 / 0 is nan, not an error)
+            value_iter = zip(*[df_touched[column].to_numpy() for column in calculation_list])
+            for node, values in zip(touched_node_dict.values(), value_iter):
+                node.__dict__.update(zip(calculation_list, values))
+        return self
+
     @property
     def node_metric_col_print_dict(self):
         """
@@ -97,55 +590,48 @@ class TreeViz(object):
         return self._node_metric_col_print_dict or \
                 self._get_default_node_metric_col_print_dict()
 
-    def _create_tree_structure(self, df, metrics):
+    def _create_tree_structure(self, df, metrics, expand_func=None, lazy_depth=None):
         """
         Function that create the whole tree structure
 
         :param df: Pandas DataFrame with some key and metric column
         :param metrics: Column of the Dataframe on which we will aggregate the value
             on a node level.
+        :param expand_func: If not None, LazyNode() are created and the ones at lazy_depth
+            are expanded with expand_func
+        :param lazy_depth: Depth of the last level of df
         :return: Return an empty tree (only the structure)
         """
         all_node_name = df.node_name.tolist()
 
+        if expand_func is None:
+            new_node = Node
+        else:
+            def new_node(node_name, metrics, parent_node=None):
+                is_last_level = node_name.count(self.SEP) >= lazy_depth
+                return LazyNode(node_name, metrics, parent_node,
+                                expand_func if is_last_level else None)
+
         # root is hardcoded because only node with no parent
         # so it wouldn't work in for loop
-        tree = Node(self.root_name, metrics)
+        tree = new_node(self.root_name, metrics)
+        node_dict = {self.root_name: tree}
         for node_name in all_node_name[1:]:
             # 'root->added->3rd party domain'.rsplit(SEP, 1) splits
             # 'root->added->3rd party domain' in ['root->added', '3rd party domain']
             parent_name = node_name.rsplit(self.SEP, 1)[0]
-            parent_node = self._get_node(tree, parent_name)
-            Node(node_name, metrics, parent_node)
+            parent_node = node_dict[parent_name]
+            node_dict[node_name] = new_node(node_name, metrics, parent_node)
         return tree
 
-    def _get_node_list_from_pathstring(self, path_strings):
-        """
-        Function that output the name of all the node based on a path_string.
-        For example : path_strings = 'A->B->C'
-        will return ['A', 'A->B', 'A->B->C'] which are all the node.
-
-        :param path_strings: A string representing the path of the node: See example above
-        :return: List of string representing node name
-        """
-        SEP = self.SEP
-        node_names = []
-        for path_string in path_strings:
-            node_names.extend(self.cumulative_names_from_right(path_string))
-
-        node_names = np.unique(node_names)
-
-        # The order is important so we can create the parent first and the child after
-        node_names = sorted(node_names, key=lambda path_string: path_string.count(SEP))
-
-        return node_names
-
     def cumulative_names_from_right(self, path_string):
         """
-        Helper function for _get_node_list_from_pathstring
+        Function that output the name of all the node on the path of path_string.
+        For example : path_string = 'A->B->C'
+        will return ['A->B->C', 'A->B', 'A'] which are all the node, from the leaf to the root.
 
-        :param path_string:
-        :return:
+        :param path_string: A string representing the path of the node: See example above
+        :return: List of string representing node name
         """
         n = len(path_string.split(self.SEP))
         return [path_string.rsplit(self.SEP, i)[0] for i in range(0, n)]
@@ -163,32 +649,151 @@ class TreeViz(object):
         assert len(node_list) == 1, "The name of the node is not unique or does not exist"
         return node_list[0]
 
-    def _get_all_node_df(self):
-        df = self.df.copy()
+    @staticmethod
+    def _is_pruned(top_k=None, min_share=None, prune_metric=None, max_depth=None):
+        return top_k is not None or min_share is not None or max_depth is not None
+
+    def _prune_leaf_df(self, df, top_k=None, min_share=None, prune_metric=None, max_depth=None,
+                       key_list=None):
+        """
+        Function that prune the leaf aggregate table before any node is created.
+        On each level, the children of a node that are not kept are renamed to other_name
+        and aggregated together, so the metrics sums stay correct. A ValueError is raised if
+        other_name is also a real value among the children of a node where folding happens.
+
+        :param df: Pandas DataFrame with one row per leaf
+        :param top_k: Keep only the top_k children of each node by prune_metric
+        :param min_share: Keep only the children with at least this share of the parent prune_metric
+        :param prune_metric: Metric used to rank the children, default to the first metric
+        :param max_depth: Maximum number of level of node_level_list to keep, at least 1 or None
+        :param key_list: Column kept in the aggregation, the children are ranked on the total
+            over these column
+        :return: The pruned DataFrame and the list of level kept
+        """
+        key_list = key_list or []
+        node_level_list = self.node_level_list if max_depth is None else \
+            self.node_level_list[:max_depth]
+        prune_metric = prune_metric or self.metrics[0]
+        df = df.groupby(key_list + node_level_list, as_index=False)[self.metrics].sum()
+
+        if top_k is None and min_share is None:
+            return df, node_level_list
+
+        for i, level in enumerate(node_level_list):
+            parent_level_list = node_level_list[:i]
+            df_child = df.groupby(parent_level_list + [level], as_index=False)[prune_metric].sum()
+            # The first level has no parent level, every child is grouped together
+            parent_key = [df_child[column] for column in parent_level_list] or \
+                [np.zeros(len(df_child))]
+            df_child_grouped = df_child.groupby(parent_key)[prune_metric]
+
+            is_kept = pd.Series(True, index=df_child.index)
+            if top_k is not None:
+                is_kept &= df_child_grouped.rank(method='first', ascending=False) <= top_k
+            if min_share is not None:
+                is_kept &= df_child[prune_metric] / df_child_grouped.transform('sum') >= min_share
+            df_child['is_kept'] = is_kept
+            if is_kept.all():
+                continue
+
+            # A real value equal to other_name would be merged with the folded children
+            is_colliding = (df_child[level].astype(str) == self.other_name) & \
+                (~is_kept).groupby(parent_key).transform('any')
+            if is_colliding.any():
+                raise ValueError("Level '{level}' has a value '{other_name}' in a node where "
+                                 "children are folded in '{other_name}', set other_name to "
+                                 "another label".format(level=level, other_name=self.other_name))
+
+            df = pd.merge(df, df_child[parent_level_list + [level, 'is_kept']],
+                          on=parent_level_list + [level])
+            # The node names are built with astype(str), casting keeps them the same and
+            # lets a numeric level hold other_name
+            df[level] = df[level].astype(str)
+            df.loc[~df['is_kept'], level] = self.other_name
+            df = df.groupby(key_list + node_level_list, as_index=False)[self.metrics].sum()
+
+        return df, node_level_list
+
+    def _get_all_node_df(self, top_k=None, min_share=None, prune_metric=None, max_depth=None,
+                         snapshot_by=None):
+        """
+        Function that aggregate the data on every node and add the calculations.
+        See _prune_leaf_df for the pruning parameters.
+
+        :param snapshot_by: If not None, one row per (node, snapshot) is returned instead of one
+            row per node. Every snapshot is present for every node, missing ones are set to 0.
+        :return: Pandas DataFrame with a node_name column, a column per metric and calculation
+        """
+        key_list = [] if snapshot_by is None else [snapshot_by]
+        df = pd.concat([self.df[key_list + self.node_level_list + self.metrics]] +
+                       self._delta_df_list)
 
         # Making sure the aggregation is the right one
-        df = df[self.node_level_list + self.metrics]\
-            .groupby(self.node_level_list, as_index=False).sum()
-
-        SEP = self.SEP
-        df['path_string'] = df[self.node_level_list].apply(lambda row: SEP.join(row.values), axis=1)
-        df['path_string'] = df['path_string'].map(lambda value: SEP.join([self.root_name, value]))
-        node_names = self._get_node_list_from_pathstring(df['path_string'].values)
-
-        # Performing a Cross Join
-        df['cross_join_id'] = 1
-        df_node_name = pd.DataFrame({'node_name': node_names, 'cross_join_id': 1})
-        df_node_name = pd.merge(df, df_node_name, on='cross_join_id')
-        df_node_name['ind'] = df_node_name.apply(lambda x: x.node_name in x.path_string, axis=1)
-        df_node_name = df_node_name[df_node_name['ind']] \
-            .groupby('node_name', as_index=False) \
-            .sum() \
-            .drop(columns=['ind', 'cross_join_id'])
+        df, node_level_list = self._prune_leaf_df(df, top_k, min_share, prune_metric, max_depth,
+                                                  key_list)
+
+        # One row per node: each level is aggregated from the level below,
+        # starting from the leaves and going up to the root
+        df_node_list = []
+        df_level = df
+        for depth in range(len(node_level_list), -1, -1):
+            if depth < len(node_level_list):
+                # The root has no level column, every row is grouped together
+                group_key = key_list + node_level_list[:depth] or np.zeros(len(df_level), dtype=int)
+                df_level = df_level.groupby(group_key, as_index=False)[self.metrics].sum()
+
+            node_name = pd.Series(self.root_name, index=df_level.index)
+            for level in node_level_list[:depth]:
+                node_name = node_name + self.SEP + df_level[level].astype(str)
+            df_node_list.append(df_level[key_list + self.metrics].assign(node_name=node_name))
+
+        # Sorting on the name makes sure the parent is always before its children
+        df_node_name = pd.concat(df_node_list)[['node_name'] + key_list + self.metrics]\
+            .sort_values(['node_name'] + key_list)\
+            .reset_index(drop=True)
+
+        if snapshot_by is not None:
+            self.snapshot_list = sorted(df[snapshot_by].unique())
+            snapshot_index = pd.MultiIndex.from_product(
+                [df_node_name['node_name'].unique(), self.snapshot_list],
+                names=['node_name', snapshot_by])
+            df_node_name = df_node_name.set_index(['node_name', snapshot_by])\
+                .reindex(snapshot_index, fill_value=0)\
+                .reset_index()
+
+        return self._apply_calculations(df_node_name, self.calculations)
 
-        if self.calculations:
-            df_node_name = df_node_name.assign(**self.calculations)
+    @staticmethod
+    def _apply_calculations(df, calculation_dict):
+        """
+        Function that add every calculation as a column of df, each one evaluated once
+        on the whole DataFrame. A calculation can use another calculation: the ones failing
+        because of a missing column are retried once the others are computed.
 
-        return df_node_name
+        :param df: Pandas DataFrame with one row per node and a column per metric
+        :param calculation_dict: A dict with key='calculation name' and value = Function to
+            be applied on the DataFrame.
+        :return: df with one more column per calculation
+        """
+        df = df.copy()
+        pending_calculation_list = list(calculation_dict.items())
+        while pending_calculation_list:
+            failed_calculation_list = []
+            error = None
+            for calculation_name, calculation in pending_calculation_list:
+                try:
+                    df[calculation_name] = calculation(df) if callable(calculation) \
+                        else calculation
+                except (KeyError, AttributeError) as calculation_error:
+                    failed_calculation_list.append((calculation_name, calculation))
+                    error = calculation_error
+
+            if len(failed_calculation_list) == len(pending_calculation_list):
+                raise KeyError("Calculation(s) {names} can't be computed: {error!r}".format(
+                    names=[calculation_name for calculation_name, _ in failed_calculation_list],
+                    error=error))
+            pending_calculation_list = failed_calculation_list
+        return df
 
     def _set_node_metric_and_calculation(self, df, tree):
         """
@@ -199,22 +804,102 @@ class TreeViz(object):
         :param tree: tree is an instance of Node()
         :return: Nothing
         """
-        for path_string in df['node_name'].values:
-            node = self._get_node(tree, path_string)
-            for metric in (self.metrics + list(self.calculations.keys())):
-                try:
-                    value = df[df.node_name == path_string][metric].values[0]
-                    node.__setattr__(metric, value)
-                except KeyError:
-                    raise KeyError(
-                        "Metric '{}' not in DataFrame columns".format(metric)
-                    )
+        column_list = self.metrics + list(self.calculations.keys())
+        missing_column_list = [column for column in column_list if column not in df.columns]
+        if missing_column_list:
+            raise KeyError("Metric '{}' not in DataFrame columns".format(missing_column_list[0]))
+
+        node_dict = {node.name: node for node in _iter_materialized(tree)}
+        # One array per column so the values keep their numpy type (0 / 0 is nan, not an error)
+        value_iter = zip(*[df[column].to_numpy() for column in column_list])
+        for node_name, values in zip(df['node_name'].values, value_iter):
+            node_dict[node_name].__dict__.update(zip(column_list, values))
         return tree
 
+    def _set_node_snapshot_values(self, df, tree):
+        """
+        Function that set on each node the vector of value per snapshot of every metric
+        and calculation.
+
+        :param df: Pandas DataFrame from _get_all_node_df(snapshot_by=...), sorted by node_name
+            and snapshot, with every snapshot for every node
+        :param tree: tree is an instance of Node()
+        :return: tree
+        """
+        node_name_list = df['node_name'].values[::len(self.snapshot_list)]
+        node_dict = {node.name: node for node in _iter_materialized(tree)}
+        self._set_snapshot_values_by_position([node_dict[node_name] for node_name in node_name_list],
+                                              np.arange(len(node_name_list)),
+                                              self._get_snapshot_matrix_dict(df))
+        return tree
+
+    def _get_snapshot_matrix_dict(self, df):
+        """
+        :param df: Pandas DataFrame from _get_all_node_df(snapshot_by=...)
+        :return: {'metric or calculation name': np.array of shape (n_node, n_snapshot)}
+        """
+        column_list = self.metrics + list(self.calculations.keys())
+        return {column: df[column].to_numpy().reshape(-1, len(self.snapshot_list))
+                for column in column_list}
+
+    @staticmethod
+    def _set_snapshot_values_by_position(node_list, position_array, snapshot_matrix_dict):
+        """
+        :param node_list: List of Node()
+        :param position_array: Row of each node in the matrices of snapshot_matrix_dict
+        :param snapshot_matrix_dict: Dict coming from _get_snapshot_matrix_dict
+        """
+        for node, position in zip(node_list, position_array):
+            node.snapshot_values = {column: snapshot_matrix[position]
+                                    for column, snapshot_matrix in snapshot_matrix_dict.items()}
+
+    def get_snapshot_value(self, node, metric, snapshot):
+        """
+        :param node: A Node() object
+        :param metric: Name of the metric or calculation
+        :param snapshot: One of snapshot_list
+        :return: Value of the metric for this snapshot
+        """
+        return node.snapshot_values[metric][self.snapshot_list.index(snapshot)]
+
+    def get_snapshot_delta(self, node, metric, snapshot, base_snapshot=None):
+        """
+        :param node: A Node() object
+        :param metric: Name of the metric or calculation
+        :param snapshot: One of snapshot_list
+        :param base_snapshot: Snapshot to compare to, default to the TreeViz base_snapshot
+        :return: Difference between the value of snapshot and the value of base_snapshot
+        """
+        base_snapshot = self._get_base_snapshot(base_snapshot)
+        return self.get_snapshot_value(node, metric, snapshot) - \
+            self.get_snapshot_value(node, metric, base_snapshot)
+
+    def get_snapshot_ratio(self, node, metric, snapshot, base_snapshot=None):
+        """
+        :param node: A Node() object
+        :param metric: Name of the metric or calculation
+        :param snapshot: One of snapshot_list
+        :param base_snapshot: Snapshot to compare to, default to the TreeViz base_snapshot
+        :return: Ratio between the value of snapshot and the value of base_snapshot
+        """
+        base_snapshot = self._get_base_snapshot(base_snapshot)
+        base_value = self.get_snapshot_value(node, metric, base_snapshot)
+        value = self.get_snapshot_value(node, metric, snapshot)
+        return value / base_value if base_value != 0 else np.nan
+
+    def _get_base_snapshot(self, base_snapshot=None):
+        if base_snapshot is not None:
+            return base_snapshot
+        if self.base_snapshot is not None:
+            return self.base_snapshot
+        return self.snapshot_list[0]
+
     def plot_tree(self, filepath,
-                  edge_prop_metric=None, node_label_func=None, node_shape_func=None):
+                  edge_prop_metric=None, node_label_func=None, node_shape_func=None,
+                  top_k=None, min_share=None, prune_metric=None, max_depth=None):
         """
-        Function that is returning the dotprogram and saving the png in filepath.
+        Function that is returning the dotprogram and saving the picture in filepath.
+        The format (png, svg, pdf...) is taken from the extension of filepath and passed to dot.
 
         :param filepath: Path of the file
         :param node_metric_col_print_dict: Dict of what we want to print in the node
@@ -224,25 +909,181 @@ class TreeViz(object):
         :param edge_prop_metric: Metric to compute the proportion on each edge
         :param node_label_func: Function to be apply to each node to get the label
         :param node_shape_func: Function to be apply to each node to get the shape
+        :param top_k: Override the top_k pruning of the TreeViz for this plot
+        :param min_share: Override the min_share pruning of the TreeViz for this plot
+        :param prune_metric: Override the prune_metric of the TreeViz for this plot
+        :param max_depth: Override the max_depth of the TreeViz for this plot
         :return: dotprogram in a string format
         """
+        dot_source = self.to_dot(edge_prop_metric, node_label_func, node_shape_func,
+                                 top_k, min_share, prune_metric, max_depth)
+        save_dot(dot_source, filepath)
+        return dot_source
 
-        render_tree = \
-            RenderTreeGraph(node=self.tree,
-                            nodeattrfunc=lambda node:
-                            self._get_node_attr(node,
-                                                node_label_func,
-                                                node_shape_func),
-                            edgeattrfunc=lambda node, child:
-                            self._get_edge_attr(node, child, edge_prop_metric))
+    def to_dot(self, edge_prop_metric=None, node_label_func=None, node_shape_func=None,
+               top_k=None, min_share=None, prune_metric=None, max_depth=None):
+        """
+        Function that build the dotprogram of the tree in one pass over the nodes.
+        See plot_tree for the parameters.
 
-        render_tree.to_picture(filepath)
-        return self._to_dot(render_tree)
+        :return: dotprogram in a string format
+        """
+        prune_dict = self._get_prune_dict(top_k=top_k, min_share=min_share,
+                                          prune_metric=prune_metric, max_depth=max_depth)
+        tree = self.tree if prune_dict == self.prune_dict else self._build_tree(**prune_dict)
+
+        # Same layout as anytree DotExporter: every node first, then every edge
+        node_line_list = ['digraph tree {']
+        edge_line_list = []
+        # Only the nodes already created are shown, the lazy nodes are not expanded
+        for node in _iter_materialized(tree):
+            node_name = self._escape_dot(node.name)
+            node_attr = self._get_node_attr(node, node_label_func, node_shape_func)
+            node_line_list.append('{indent}"{node_name}" [{node_attr}];'.format(
+                indent=DOT_INDENT, node_name=node_name, node_attr=node_attr))
+            for child in node.materialized_children:
+                edge_attr = self._get_edge_attr(node, child, edge_prop_metric)
+                edge_line_list.append('{indent}"{node_name}" -> "{child_name}" [{edge_attr}];'.format(
+                    indent=DOT_INDENT, node_name=node_name,
+                    child_name=self._escape_dot(child.name), edge_attr=edge_attr))
+        edge_line_list.append('}')
+        return '\n'.join(node_line_list + edge_line_list)
+
+    def _get_prune_dict(self, **prune_override_dict):
+        """
+        Function that return the pruning of the TreeViz updated with the overrides
+        that are not None.
+
+        :param prune_override_dict: top_k, min_share, prune_metric and/or max_depth
+        :return: dict with the parameters of _prune_leaf_df
+        """
+        prune_dict = dict(self.prune_dict)
+        prune_dict.update({key: value for key, value in prune_override_dict.items()
+                           if value is not None})
+        self._check_prune_dict(prune_dict)
+        return prune_dict
+
+    @staticmethod
+    def _check_prune_dict(prune_dict):
+        """
+        Function that raise a ValueError if max_depth is not None and below 1,
+        the root alone is not a tree that can be pruned.
+
+        :param prune_dict: dict with the parameters of _prune_leaf_df
+        """
+        max_depth = prune_dict.get('max_depth')
+        if max_depth is not None and max_depth < 1:
+            raise ValueError("max_depth must be at least 1 or None, got {}".format(max_depth))
+
+    @staticmethod
+    def _escape_dot(value):
+        return _RE_DOT_ESCAPE.sub(r'\\\1', str(value))
+
+    def to_plotly(self, kind='sunburst', value_metric=None, color_metric=None,
+                  top_k=None, min_share=None, prune_metric=None, max_depth=None):
+        """
+        Function that return an interactive plotly figure of the tree. The figure is built
+        directly from the node table, no Node() object is created.
+
+        :param kind: one of PLOTLY_KIND_DICT keys: 'sunburst', 'treemap' or 'icicle'
+        :param value_metric: Metric giving the size of each node, default to the first metric.
+            Calculations are not allowed, a child could be bigger than its parent.
+        :param color_metric: Metric or calculation giving the color of each node
+        :param top_k: Override the top_k pruning of the TreeViz for this plot
+        :param min_share: Override the min_share pruning of the TreeViz for this plot
+        :param prune_metric: Override the prune_metric of the TreeViz for this plot
+        :param max_depth: Override the max_depth of the TreeViz for this plot
+        :return: plotly Figure
+        """
+        if kind not in PLOTLY_KIND_DICT:
+            raise ValueError("kind argument should be in {kind_list},"
+                             " got {kind} instead".format(kind_list=list(PLOTLY_KIND_DICT),
+                                                          kind=kind))
+        value_metric = value_metric or self.metrics[0]
+        if value_metric not in self.metrics:
+            raise ValueError("value_metric argument should be in {metrics},"
+                             " got {value_metric} instead".format(metrics=self.metrics,
+                                                                  value_metric=value_metric))
+        try:
+            import plotly.graph_objs as go
+        except ImportError:
+            raise ImportError("plotly is needed to export the tree as a plotly figure")
+        if not hasattr(go, PLOTLY_KIND_DICT[kind]):
+            raise ImportError("plotly>=4.14 is needed for kind='{kind}'".format(kind=kind))
+
+        prune_dict = self._get_prune_dict(top_k=top_k, min_share=min_share,
+                                          prune_metric=prune_metric, max_depth=max_depth)
+        df_all_node = self._get_cached_all_node_df(**prune_dict)
+
+        # 'root->A->B'.rsplit(SEP, 1) gives the parent 'root->A' and the label 'B'
+        node_name_split = df_all_node['node_name'].str.rsplit(self.SEP, n=1)
+        is_root = (df_all_node['node_name'] == self.root_name).values
+        parent_array = np.where(is_root, '', node_name_split.str[0])
+        label_array = np.where(is_root, 'Total', node_name_split.str[-1])
+
+        column_list = self.metrics + list(self.calculations.keys())
+        node_metric_col_print_dict = self._node_metric_col_print_dict or \
+            self._get_default_node_metric_col_print_dict(df_all_node.iloc[0][column_list].to_dict())
+        hover_column_list = [column for column in node_metric_col_print_dict
+                             if column in column_list]
+        hover_line_list = ['<b>%{label}</b>']
+        for i, column in enumerate(hover_column_list):
+            hover_line_list.append('{name}: %{{customdata[{i}]:{plotly_format}}}'.format(
+                name=column.replace('_', ' '), i=i,
+                plotly_format=self._plotly_format(**node_metric_col_print_dict[column])))
+
+        marker = {} if color_metric is None else \
+            {'colors': df_all_node[color_metric].values, 'colorscale': 'Blues',
+             'showscale': True, 'colorbar': {'title': color_metric.replace('_', ' ')}}
+
+        trace = getattr(go, PLOTLY_KIND_DICT[kind])(
+            ids=df_all_node['node_name'].values,
+            parents=parent_array,
+            labels=label_array,
+            values=df_all_node[value_metric].values,
+            branchvalues='total',
+            customdata=df_all_node[hover_column_list].values,
+            hovertemplate='<br>'.join(hover_line_list) + '<extra></extra>',
+            marker=marker)
+        return go.Figure(data=[trace], layout={'margin': {'t': 10, 'l': 10, 'r': 10, 'b': 10}})
+
+    def to_html(self, filepath, kind='sunburst', include_plotlyjs='cdn', **to_plotly_kwargs):
+        """
+        Function that save the interactive plotly figure of the tree in an html file.
+        By default plotly.js is loaded from a CDN instead of being written in the file.
+
+        :param filepath: Path of the html file
+        :param kind: one of 'sunburst', 'treemap' or 'icicle'
+        :param include_plotlyjs: See plotly.io.write_html, True to write plotly.js in the file
+        :param to_plotly_kwargs: Other parameters of to_plotly
+        :return: plotly Figure
+        """
+        figure = self.to_plotly(kind, **to_plotly_kwargs)
+        figure.write_html(filepath, include_plotlyjs=include_plotlyjs)
+        return figure
+
+    @staticmethod
+    def _plotly_format(type='int', digits=2):
+        """
+        Function that return the d3 format used by plotly equivalent to _format_string.
+
+        :param type: one of ['int', 'float', 'percent']
+        :param digits: Number of digits for type float or percent
+        :return: d3 format string
+        """
+        if type == 'float':
+            return ',.{digits}f'.format(digits=digits)
+        elif type == 'percent':
+            return ',.{digits}%'.format(digits=digits)
+        elif type == 'int':
+            return ','
+        else:
+            raise ValueError("type argument should be 'int', 'float' or 'percent',"
+                             " got {type} instead".format(type=type))
 
     def _get_node_attr(self, node, node_label_func=None, node_shape_func=None):
         """
-        Function that output the right function to use for the nodeattrfunc parameter
-            of the  RenderTreeGraph().
+        Function that output the attribute string of a node in the dotprogram.
 
         :param node: The Node() object
         :param node_shape_func: Function to be apply to each node to get the shape
@@ -260,8 +1101,7 @@ class TreeViz(object):
 
     def _get_edge_attr(self, node, child,  edge_prop_metric=None, edge_label_func=None):
         """
-        Function that output the right function to use for the edgeattrfunc parameter
-            of the  RenderTreeGraph().
+        Function that output the attribute string of an edge in the dotprogram.
 
         :param node: The Node() object
         :param child: Child of the Node object (Also a Node())
@@ -306,6 +1146,7 @@ class TreeViz(object):
             applied on each node.
         """
         self.calculations.update(calculation_dict)
+        self._tree = None
 
     @staticmethod
     def _add_calculation_to_node(tree, calculation_dict):
@@ -318,25 +1159,34 @@ class TreeViz(object):
         :return: Nothing
         """
         if len(calculation_dict) > 0:
-            for node in PreOrderIter(tree):
-                node._add_calculation(calculation_dict)
+            # Every node share the same dict, Node._add_calculation copies it before updating
+            shared_calculation_dict = dict(calculation_dict)
+            for node in _iter_materialized(tree):
+                node.calculation = shared_calculation_dict
 
-    def _get_default_node_metric_col_print_dict(self):
+    def _get_default_node_metric_col_print_dict(self, root_value_dict=None):
         """
         Function that return the default node_metric_col_print_dict by doing
             some inference on the root node (tree)
 
+        :param root_value_dict: {'metric or calculation name': value} of the root,
+            read from the tree if None
         :return: dict
         """
+        if root_value_dict is None:
+            root_value_dict = {column: self.tree.__getattr__(column) for column in
+                               self.metrics + list(self.tree.calculation.keys())}
+        calculation_list = [column for column in root_value_dict if column not in self.metrics]
+
         int_metrics = [metric for metric in self.metrics if
-                       float(self.tree.__getattr__(metric)).is_integer()]
+                       float(root_value_dict[metric]).is_integer()]
         float_metrics = [metric for metric in self.metrics if
-                         not float(self.tree.__getattr__(metric)).is_integer()]
+                         not float(root_value_dict[metric]).is_integer()]
 
-        int_calculations = [calculation for calculation in self.tree.calculation.keys() if
-                            float(self.tree.__getattr__(calculation)).is_integer()]
-        float_calculations = [calculation for calculation in self.tree.calculation.keys() if
-                              not float(self.tree.__getattr__(calculation)).is_integer()]
+        int_calculations = [calculation for calculation in calculation_list if
+                            float(root_value_dict[calculation]).is_integer()]
+        float_calculations = [calculation for calculation in calculation_list if
+                              not float(root_value_dict[calculation]).is_integer()]
 
         int_format_dict = {column:{'type': 'int', 'digits':0} for column in
                            (int_metrics + int_calculations)}
@@ -367,6 +1217,9 @@ class TreeViz(object):
                 metric_tmp = "{0}: {1}".format(metric_name.replace('_', ' '),
                                                metric_formated)
                 metric_string_list.append(metric_tmp)
+                if metric_name in node.snapshot_values:
+                    metric_string_list.extend(
+                        self._get_snapshot_label_list(node, metric_name, layout_dict))
 
         metric_string = "\n".join(metric_string_list)
         return 'label="{node_name}\n{separator}\n{metric_string}"'.\
@@ -374,20 +1227,35 @@ class TreeViz(object):
                    separator="-----------",
                    metric_string=metric_string)
 
-    @staticmethod
-    def _to_dot(render_tree):
+    def _get_snapshot_label_list(self, node, metric_name, layout_dict):
         """
-        :param render_tree: Object coming from RenderTreeGraph(Node)
-        :return: String of the dot program
+        Function that return one label line per snapshot, the snapshots other than
+        the base one also show the delta and the ratio to the base snapshot.
+
+        :param node: A Node() object
+        :param metric_name: Name of the metric or calculation
+        :param layout_dict: {'type': type, 'digits': digits}
+        :return: List of label string
         """
-        lines = [line for line in render_tree]
-        return "\n".join(lines)
+        base_snapshot = self._get_base_snapshot()
+        snapshot_string_list = []
+        for snapshot in self.snapshot_list:
+            value = self.get_snapshot_value(node, metric_name, snapshot)
+            snapshot_string = "  {0}: {1}".format(
+                snapshot, self._format_string(value, layout_dict['type'], layout_dict['digits']))
+            if snapshot != base_snapshot:
+                delta = self.get_snapshot_delta(node, metric_name, snapshot)
+                ratio = self.get_snapshot_ratio(node, metric_name, snapshot)
+                snapshot_string += " ({sign}{delta}, x{ratio})".format(
+                    sign='+' if delta >= 0 else '',
+                    delta=self._format_string(delta, layout_dict['type'], layout_dict['digits']),
+                    ratio=self._format_string(ratio, 'float', 2))
+            snapshot_string_list.append(snapshot_string)
+        return snapshot_string_list
 
     @staticmethod
-    def _plot_dot(render_tree):
-        render_tree.to_picture("tbd.png")
-        Image.open("tbd.png").show()
-        os.system("rm tbd.png")
+    def _plot_dot(dot_source):
+        Image.open(io.BytesIO(render_dot(dot_source, 'png'))).show()
 
     def update_node_metric_col_print_dict(self, node_metric_col_print_dict):
         """
@@ -398,3 +1266,446 @@ class TreeViz(object):
         :return:
         """
         self._node_metric_col_print_dict.update(node_metric_col_print_dict)
+
+
+def render_dot(dot_source, fileformat='png'):
+    """
+    Function that pipe the dotprogram to graphviz through stdin/stdout, no file is written.
+
+    :param dot_source: dotprogram in a string format
+    :param fileformat: Any output format of graphviz (png, svg, pdf, jpg, gif, dot...)
+    :return: The rendered picture in bytes
+    """
+    if not fileformat:
+        raise ValueError("fileformat argument should be a graphviz output format,"
+                         " got {fileformat!r} instead".format(fileformat=fileformat))
+
+    cmd = ['dot', '-T{}'.format(fileformat)]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate(dot_source.encode('utf-8'))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, error)
+    return output
+
+
+def save_dot(dot_source, filepath):
+    """
+    Function that render the dotprogram and save it in filepath.
+
+    :param dot_source: dotprogram in a string format
+    :param filepath: Path of the file, the extension gives the format
+    """
+    fileformat = os.path.splitext(filepath)[1][1:].lower()
+    picture = render_dot(dot_source, fileformat)
+    with open(filepath, 'wb') as picture_file:
+        picture_file.write(picture)
+
+
+def _save_dot_from_tuple(dot_source_filepath):
+    return save_dot(*dot_source_filepath)
+
+
+def plot_trees(tree_viz_list, filepath_list, processes=None, **plot_tree_kwargs):
+    """
+    Function that plot many trees at once. The dotprograms are built in this process
+    (node_label_func and calculations can't always be pickled) and the graphviz
+    renderings are done on a process pool.
+
+    :param tree_viz_list: List of TreeViz() object
+    :param filepath_list: List of the path of the files, same length as tree_viz_list
+    :param processes: Number of processes of the pool, default to the number of cpu
+    :param plot_tree_kwargs: Other parameters of TreeViz.plot_tree
+    :return: List of dotprogram in a string format
+    """
+    if len(tree_viz_list) != len(filepath_list):
+        raise ValueError("tree_viz_list and filepath_list should have the same length")
+
+    dot_source_list = [tree_viz.to_dot(**plot_tree_kwargs) for tree_viz in tree_viz_list]
+
+    pool = Pool(processes)
+    try:
+        pool.map(_save_dot_from_tuple, zip(dot_source_list, filepath_list))
+    finally:
+        pool.close()
+        pool.join()
+    return dot_source_list
+
+
+# Data of a TreeViz that is aggregated by aggregate_func only when it is needed,
+# fingerprint identifies the data without reading it
+_LeafSource = namedtuple('_LeafSource', ['aggregate_func', 'fingerprint'])
+
+
+def _hash_df(df, column_list=None):
+    """
+    :param df: Pandas DataFrame
+    :param column_list: Column to hash, every column if None
+    :return: sha1 of the names, dtypes and values of the columns
+    """
+    sha1 = hashlib.sha1()
+    # Column by column, df[column_list] would copy the data
+    for column in df.columns if column_list is None else column_list:
+        sha1.update(json.dumps([str(column), str(df[column].dtype)]).encode('utf-8'))
+        sha1.update(pd.util.hash_pandas_object(df[column], index=False).values.tobytes())
+    return sha1.hexdigest()
+
+
+def _read_file_chunks(filepath, chunksize=100000, column_list=None):
+    """
+    Function that read a CSV or Parquet file by chunk of chunksize rows.
+
+    :param filepath: Path of a .csv or .parquet file
+    :param chunksize: Number of rows read at once
+    :param column_list: Column to read, every column if None
+    :return: Iterator of Pandas DataFrame
+    """
+    if _check_file_extension(filepath) == '.csv':
+        return pd.read_csv(filepath, chunksize=chunksize, usecols=column_list)
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is needed to read Parquet file by chunk")
+    return (batch.to_pandas() for batch in
+            pq.ParquetFile(filepath).iter_batches(batch_size=chunksize, columns=column_list))
+
+
+def _check_file_extension(filepath):
+    """
+    :return: The extension of filepath, a ValueError is raised if it's not a CSV or Parquet one
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension not in ['.csv', '.parquet', '.pq']:
+        raise ValueError("filepath should be a .csv or .parquet file,"
+                         " got {extension} instead".format(extension=extension))
+    return extension
+
+
+def _aggregate_file(filepath, chunksize, column_list, group_list, metrics, processes):
+    return aggregate_chunks(_read_file_chunks(filepath, chunksize, column_list), group_list,
+                            metrics, processes)
+
+
+def _aggregate_chunk(chunk_group_list_metrics):
+    chunk, group_list, metrics = chunk_group_list_metrics
+    # Missing keys are kept so TreeViz can report them instead of losing the rows
+    return chunk[group_list + metrics].groupby(group_list, as_index=False, dropna=False).sum()
+
+
+def aggregate_chunks(chunks, group_list, metrics, processes=None):
+    """
+    Function that sum the metrics by group_list over many DataFrame (map-reduce).
+    The chunks are aggregated on a process pool a few at a time, and merged in the
+    running aggregate, so only a few chunks are in memory at once.
+
+    :param chunks: Iterable of Pandas DataFrame
+    :param group_list: Column to group by
+    :param metrics: Column to sum
+    :param processes: Number of processes of the pool, default to the number of cpu.
+        With processes=1 the chunks are aggregated in this process.
+    :return: Pandas DataFrame with one row per group
+    """
+    processes = processes or cpu_count()
+    pool = Pool(processes) if processes > 1 else None
+    chunk_iter = iter(chunks)
+
+    df_aggregate_list = []
+    try:
+        while True:
+            task_list = [(chunk, group_list, metrics)
+                         for chunk in islice(chunk_iter, 2 * processes)]
+            if not task_list:
+                break
+            partial_list = pool.map(_aggregate_chunk, task_list) if pool is not None \
+                else [_aggregate_chunk(task) for task in task_list]
+            df_aggregate_list = [_aggregate_chunk(
+                (pd.concat(df_aggregate_list + partial_list), group_list, metrics))]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if not df_aggregate_list:
+        return pd.DataFrame(columns=group_list + metrics)
+    return df_aggregate_list[0]
+
+
+_HASH_PRIMITIVE_TYPES = (type(None), bool, int, float, complex, str, bytes)
+
+
+def _iter_code_names(code):
+    """
+    :param code: code object
+    :return: Generator of the names (globals and attributes) used by code and its nested code
+    """
+    for name in code.co_names:
+        yield name
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            for name in _iter_code_names(const):
+                yield name
+
+
+def _update_hash(sha1, value, seen_id_set=None):
+    """
+    Function that add value to the hash with a content that doesn't change between processes.
+    A function is hashed with its code (nested code objects included), its default values,
+    its closure cells and the globals it uses.
+
+    :param sha1: hashlib object
+    :param value: Value to hash
+    :param seen_id_set: id of the functions and containers already hashed, to stop on cycles
+    :return: False if value can't be hashed reliably
+    """
+    seen_id_set = set() if seen_id_set is None else seen_id_set
+    sha1.update(type(value).__name__.encode('utf-8'))
+
+    if isinstance(value, _HASH_PRIMITIVE_TYPES):
+        sha1.update(repr(value).encode('utf-8'))
+        return True
+    if id(value) in seen_id_set:
+        return True
+
+    if isinstance(value, (tuple, list)):
+        seen_id_set.add(id(value))
+        sha1.update(str(len(value)).encode('utf-8'))
+        return all(_update_hash(sha1, item, seen_id_set) for item in value)
+    if isinstance(value, (set, frozenset)):
+        # The order of a set is only stable for primitive values
+        if not all(isinstance(item, _HASH_PRIMITIVE_TYPES) for item in value):
+            return False
+        return _update_hash(sha1, sorted(value, key=repr), seen_id_set)
+    if isinstance(value, dict):
+        if not all(isinstance(key, _HASH_PRIMITIVE_TYPES) for key in value):
+            return False
+        seen_id_set.add(id(value))
+        return all(_update_hash(sha1, key, seen_id_set) and
+                   _update_hash(sha1, value[key], seen_id_set)
+                   for key in sorted(value, key=repr))
+    if isinstance(value, types.CodeType):
+        sha1.update(value.co_code)
+        return _update_hash(sha1, (value.co_names, value.co_varnames, value.co_freevars,
+                                   value.co_consts), seen_id_set)
+    if isinstance(value, types.FunctionType):
+        seen_id_set.add(id(value))
+        try:
+            closure_list = [cell.cell_contents for cell in value.__closure__ or ()]
+        except ValueError:
+            # Empty cell, the function can't be called anyway
+            return False
+        global_name_list = sorted(set(name for name in _iter_code_names(value.__code__)
+                                      if name in value.__globals__))
+        return all([_update_hash(sha1, value.__code__, seen_id_set),
+                    _update_hash(sha1, value.__defaults__, seen_id_set),
+                    _update_hash(sha1, value.__kwdefaults__, seen_id_set),
+                    _update_hash(sha1, closure_list, seen_id_set),
+                    _update_hash(sha1, [(name, value.__globals__[name])
+                                        for name in global_name_list], seen_id_set)])
+    if isinstance(value, partial):
+        seen_id_set.add(id(value))
+        return _update_hash(sha1, (value.func, value.args, value.keywords), seen_id_set)
+    if isinstance(value, types.ModuleType):
+        sha1.update(value.__name__.encode('utf-8'))
+        return True
+    if isinstance(value, (type, types.BuiltinFunctionType, np.ufunc)):
+        sha1.update('{}.{}'.format(getattr(value, '__module__', None),
+                                   getattr(value, '__qualname__', value.__name__))
+                    .encode('utf-8'))
+        return True
+    if isinstance(value, (np.ndarray, np.generic)):
+        if value.dtype.hasobject:
+            return False
+        sha1.update(str(value.dtype).encode('utf-8'))
+        sha1.update(np.ascontiguousarray(value).tobytes())
+        return True
+    if isinstance(value, (pd.Series, pd.DataFrame, pd.Index)):
+        sha1.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+        return True
+    return False
+
+
+def _encode_column(values):
+    """
+    Function that convert a column in numpy arrays that can be saved in .npy files and
+    memory-mapped, see _decode_column.
+
+    :param values: Pandas Series
+    :return: dict {key: np.array} and a dict that can be written in json describing the
+        encoding, (None, None) if the column can't be saved
+    """
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        category_array_dict, category_encoding = _encode_column(pd.Series(dtype.categories))
+        if category_array_dict is None:
+            return None, None
+        array_dict = {'.codes': values.cat.codes.to_numpy()}
+        array_dict.update({'.categories' + key: array
+                           for key, array in category_array_dict.items()})
+        return array_dict, {'encoding': 'category', 'ordered': bool(dtype.ordered),
+                            'categories': category_encoding}
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return {'': values.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy()}, \
+            {'encoding': 'datetime_tz', 'tz': str(dtype.tz)}
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufmM':
+        return {'': values.to_numpy()}, {'encoding': 'numpy'}
+    if pd.api.types.infer_dtype(values, skipna=False) in ['string', 'empty']:
+        return {'': values.to_numpy(dtype=str)}, {'encoding': 'str'}
+    return None, None
+
+
+def _decode_column(array_dict, encoding_dict):
+    """
+    Function that rebuild a column encoded by _encode_column.
+
+    :param array_dict: dict {key: np.array}
+    :param encoding_dict: dict describing the encoding
+    :return: np.array or pandas array, numpy columns are returned as is (memory-mapped)
+    """
+    encoding = encoding_dict['encoding']
+    if encoding == 'category':
+        categories = _decode_column({key[len('.categories'):]: array
+                                     for key, array in array_dict.items()
+                                     if key.startswith('.categories')},
+                                    encoding_dict['categories'])
+        return pd.Categorical.from_codes(array_dict['.codes'], categories=categories,
+                                         ordered=encoding_dict['ordered'])
+    if encoding == 'datetime_tz':
+        return pd.DatetimeIndex(array_dict['']).tz_localize('UTC')\
+            .tz_convert(encoding_dict['tz']).array
+    return array_dict['']
+
+
+def _get_parent_id(node_name, sep='->'):
+    """
+    :param node_name: Pandas Series of the node names
+    :param sep: Separator of the node names
+    :return: np.array with the position of the parent of each node in the unique node names,
+        -1 for the root
+    """
+    parent_name = node_name.str.rsplit(sep, n=1).str[0]
+    parent_id = pd.Index(pd.unique(node_name)).get_indexer(parent_name)
+    parent_id[(parent_name == node_name).to_numpy()] = -1
+    return parent_id
+
+
+def save_node_table(df, cache_path, metadata, sep='->', snapshot_list=None):
+    """
+    Function that save a node table in cache_path: one .npy file per array, so they can be
+    memory-mapped when reloaded, a parent_id array and a metadata.json file.
+    The id of a node is its position in the unique node_name of the table and the parent_id
+    of the root is -1.
+
+    The entry is written in a temporary directory that replaces cache_path once complete,
+    so a reader never sees a mix of two entries. Nothing is written if a column can't be saved.
+
+    :param df: Pandas DataFrame with a node_name column, coming from TreeViz._get_all_node_df
+    :param cache_path: Directory of the entry
+    :param metadata: Dict that can be written in json, saved with the column list
+    :param sep: Separator of the node names
+    :param snapshot_list: List of the snapshots, saved with the same encoding as the columns
+    :return: True if the entry is saved
+    """
+    array_dict = {}
+    column_encoding_list = []
+    column_series_list = [(column, df[column]) for column in df.columns]
+    if snapshot_list is not None:
+        column_series_list.append(('snapshot_list', pd.Series(snapshot_list)))
+    for i, (column, values) in enumerate(column_series_list):
+        column_array_dict, encoding_dict = _encode_column(values)
+        if column_array_dict is None:
+            return False
+        prefix = 'column_{}'.format(i)
+        array_dict.update({prefix + key: array for key, array in column_array_dict.items()})
+        column_encoding_list.append(dict(encoding_dict, name=str(column), prefix=prefix,
+                                         key_list=list(column_array_dict)))
+
+    array_dict['parent_id'] = _get_parent_id(df['node_name'], sep)
+
+    metadata = dict(metadata, version=NODE_TABLE_CACHE_VERSION, entry_id=uuid.uuid4().hex,
+                    column_list=column_encoding_list[:len(df.columns)],
+                    snapshot_list=None if snapshot_list is None else column_encoding_list[-1])
+
+    cache_parent_path = os.path.dirname(os.path.abspath(cache_path))
+    if not os.path.isdir(cache_parent_path):
+        os.makedirs(cache_parent_path)
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(cache_path) + '.tmp-',
+                                dir=cache_parent_path)
+    old_path = '{}.old-{}'.format(cache_path, metadata['entry_id'])
+    try:
+        for key, array in array_dict.items():
+            np.save(os.path.join(tmp_path, key + '.npy'), array)
+        with open(os.path.join(tmp_path, 'metadata.json'), 'w') as metadata_file:
+            json.dump(metadata, metadata_file, default=str)
+
+        # A directory can't be replaced while it is not empty, the old entry is moved first
+        if os.path.isdir(cache_path):
+            os.replace(cache_path, old_path)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Another process wrote the entry at the same time, its entry is kept
+        return False
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+    return True
+
+
+def _read_metadata(cache_path):
+    try:
+        with open(os.path.join(cache_path, 'metadata.json')) as metadata_file:
+            return json.load(metadata_file)
+    except (IOError, ValueError):
+        return None
+
+
+def load_node_table(cache_path, fingerprint=None):
+    """
+    Function that reload a node table saved by save_node_table. The numeric and datetime
+    columns stay memory-mapped, the text columns are converted to pandas strings.
+
+    :param cache_path: Directory of the entry
+    :param fingerprint: Expected fingerprint, the entry is stale if it has another one
+    :return: The node table (without the parent_id column) and the metadata with the
+        snapshot_list decoded, (None, None) if the entry is missing or stale
+    """
+    metadata = _read_metadata(cache_path)
+    if metadata is None or metadata.get('version') != NODE_TABLE_CACHE_VERSION or \
+            (fingerprint is not None and metadata.get('fingerprint') != fingerprint):
+        return None, None
+
+    def load_column(encoding_dict):
+        # np.asarray gives an ndarray view of the np.memmap
+        return _decode_column({key: np.asarray(np.load(os.path.join(
+            cache_path, encoding_dict['prefix'] + key + '.npy'), mmap_mode='r'))
+            for key in encoding_dict['key_list']}, encoding_dict)
+
+    try:
+        column_dict = {encoding_dict['name']: load_column(encoding_dict)
+                       for encoding_dict in metadata['column_list']}
+        snapshot_list = None if metadata['snapshot_list'] is None else \
+            pd.Series(load_column(metadata['snapshot_list'])).tolist()
+    except (IOError, ValueError):
+        return None, None
+
+    # The entry was replaced while it was read
+    current_metadata = _read_metadata(cache_path)
+    if current_metadata is None or current_metadata.get('entry_id') != metadata['entry_id']:
+        return None, None
+
+    df = pd.DataFrame(column_dict, columns=list(column_dict), copy=False)
+    return df, dict(metadata, snapshot_list=snapshot_list)
+
+
+def _iter_materialized(tree):
+    """
+    Function that iterate over the nodes already created in pre-order, like PreOrderIter
+    but without expanding the LazyNode()
+
+    :param tree: Node() object
+    :return: Generator of Node()
+    """
+    node_stack = [tree]
+    while node_stack:
+        node = node_stack.pop()
+        yield node
+        node_stack.extend(reversed(node.materialized_children))
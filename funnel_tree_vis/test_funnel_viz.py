@@ -0,0 +1,652 @@
+from . import funnel_viz
+from .funnel_viz import TreeViz, render_dot, save_dot, plot_trees
+from .benchmark_funnel_viz import gen_funnel_df, run_benchmark, get_scaling_exponent, STAGE_LIST
+from anytree import PreOrderIter
+from anytree.exporter import DotExporter
+import multiprocessing
+import os
+import subprocess
+import sys
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def gen_df():
+
+    df = pd.DataFrame({'impression': ['Impression', 'Impression', 'No Impression', 'No Impression'],
+                       'click': ['Click', 'No Click', 'Click', 'No Click'],
+                       'users': [10000, 100000, 1000, 300000],
+                       'conversions': [1000, 5000, 90, 100]})
+
+    return df
+
+
+def gen_calculations():
+    return {'conversion_rate': lambda df: df.conversions / df.users}
+
+
+def tree_to_dict(tree, columns):
+    return {node.name: tuple(float(node.__getattr__(column)) for column in columns)
+            for node in PreOrderIter(tree)}
+
+
+def test_update_matches_rebuild():
+    df = gen_df()
+    df_delta = pd.DataFrame({'impression': ['Impression', 'Impression'],
+                             'click': ['Click', 'Click'],
+                             'users': [5, 10],
+                             'conversions': [1, 2]})
+    columns = ['users', 'conversions', 'conversion_rate']
+
+    tree_viz = TreeViz(df, calculations=gen_calculations())
+    tree_viz.tree
+    tree_viz.update(df_delta)
+
+    expected = TreeViz(pd.concat([df, df_delta]), calculations=gen_calculations())
+    assert tree_to_dict(tree_viz.tree, columns) == tree_to_dict(expected.tree, columns)
+
+
+def test_update_creates_new_path():
+    df = gen_df()
+    df_delta = pd.DataFrame({'impression': ['Unknown'],
+                             'click': ['Click'],
+                             'users': [20],
+                             'conversions': [4]})
+    columns = ['users', 'conversions', 'conversion_rate']
+
+    tree_viz = TreeViz(df, calculations=gen_calculations())
+    tree_viz.tree
+    tree_viz.update(df_delta)
+
+    actual = tree_to_dict(tree_viz.tree, columns)
+    assert actual['root->Unknown'] == (20, 4, 0.2)
+    assert actual['root->Unknown->Click'] == (20, 4, 0.2)
+    assert actual['root'][:2] == (411020, 6194)
+
+    expected = TreeViz(pd.concat([df, df_delta]), calculations=gen_calculations())
+    assert actual == tree_to_dict(expected.tree, columns)
+
+
+def test_update_before_tree_is_built():
+    df = gen_df()
+    tree_viz = TreeViz(df.iloc[:2])
+    tree_viz.update(df.iloc[2:])
+
+    expected = TreeViz(df)
+    assert tree_to_dict(tree_viz.tree, ['users']) == tree_to_dict(expected.tree, ['users'])
+
+
+def gen_wide_df():
+
+    df = pd.DataFrame({'source': ['A', 'A', 'B', 'B', 'C', 'D'],
+                       'click': ['Click', 'No Click', 'Click', 'No Click', 'Click', 'No Click'],
+                       'users': [50, 30, 10, 5, 3, 2],
+                       'conversions': [5, 1, 2, 1, 1, 0]})
+
+    return df
+
+
+def test_prune_top_k():
+    columns = ['users', 'conversions', 'conversion_rate']
+    tree_viz = TreeViz(gen_wide_df(), calculations=gen_calculations(), top_k=2)
+    actual = tree_to_dict(tree_viz.tree, columns)
+
+    assert sorted(actual) == ['root', 'root->A', 'root->A->Click', 'root->A->No Click',
+                              'root->B', 'root->B->Click', 'root->B->No Click',
+                              'root->Other', 'root->Other->Click', 'root->Other->No Click']
+    assert actual['root->Other'] == (5, 1, 0.2)
+    assert actual['root->Other->Click'] == (3, 1, 1 / 3)
+    assert actual['root'] == (100, 10, 0.1)
+
+
+def test_prune_min_share_and_max_depth():
+    tree_viz = TreeViz(gen_wide_df(), min_share=0.1, max_depth=1)
+    actual = tree_to_dict(tree_viz.tree, ['users'])
+
+    assert actual == {'root': (100,), 'root->A': (80,), 'root->B': (15,), 'root->Other': (5,)}
+
+
+def test_prune_max_depth_below_one():
+    with pytest.raises(ValueError):
+        TreeViz(gen_wide_df(), max_depth=0)
+
+    tree_viz = TreeViz(gen_wide_df())
+    with pytest.raises(ValueError):
+        tree_viz.to_dot(max_depth=0)
+    assert len(list(PreOrderIter(tree_viz.tree))) == len(list(PreOrderIter(
+        tree_viz._build_tree(max_depth=2))))
+
+def test_prune_override_does_not_change_tree():
+    tree_viz = TreeViz(gen_wide_df(), top_k=1)
+    pruned_tree = tree_viz._build_tree(top_k=1, max_depth=1)
+
+    assert len(list(PreOrderIter(pruned_tree))) == 3
+    assert len(list(PreOrderIter(tree_viz.tree))) == 7
+
+
+def test_to_dot_matches_anytree_exporter():
+    tree_viz = TreeViz(gen_df(), calculations=gen_calculations())
+    tree_viz.tree.children[0].name = 'root->"Impression"'
+
+    expected = DotExporter(tree_viz.tree,
+                           nodeattrfunc=lambda node: tree_viz._get_node_attr(node),
+                           edgeattrfunc=lambda node, child:
+                           tree_viz._get_edge_attr(node, child, 'users'))
+    assert tree_viz.to_dot(edge_prop_metric='users') == "\n".join(expected)
+
+
+def gen_large_df(n_level=3, fan_out=8, n_row=20000):
+    random_state = np.random.RandomState(0)
+    df = pd.DataFrame({'level_{}'.format(i): random_state.randint(0, fan_out, n_row).astype(str)
+                       for i in range(n_level)})
+    df['users'] = random_state.randint(1, 1000, n_row)
+    df['conversions'] = random_state.randint(0, 100, n_row)
+    return df
+
+
+def test_many_calculations_on_large_tree():
+    df = gen_large_df()
+    calculations = {'conversion_rate': lambda df: df.conversions / df.users}
+    for i in range(1, 30):
+        calculations['calculation_{}'.format(i)] = \
+            lambda df, i=i: df.conversion_rate * i + df.users
+
+    tree_viz = TreeViz(df, calculations=calculations)
+    node_list = list(PreOrderIter(tree_viz.tree))
+    assert len(node_list) == 1 + 8 + 8 ** 2 + 8 ** 3
+
+    for node in node_list:
+        leaf_filter = np.ones(len(df), dtype=bool)
+        for level, value in zip(tree_viz.node_level_list, node.name.split('->')[1:]):
+            leaf_filter &= (df[level] == value).values
+        users = df.users[leaf_filter].sum()
+        conversions = df.conversions[leaf_filter].sum()
+        assert node.users == users
+        assert node.conversions == conversions
+        assert node.conversion_rate == pytest.approx(conversions / users)
+        assert node.calculation_29 == pytest.approx(conversions / users * 29 + users)
+        assert node.calculation is tree_viz.tree.calculation
+
+
+def test_calculation_dependency_order():
+    calculations = {'calculation_2': lambda df: df.calculation_1 * 2,
+                    'calculation_1': lambda df: df.conversion_rate + 1,
+                    'conversion_rate': lambda df: df.conversions / df.users}
+    tree_viz = TreeViz(gen_df(), calculations=calculations)
+
+    assert tree_viz.tree.calculation_2 == pytest.approx((6190 / 411000 + 1) * 2)
+
+
+def test_calculation_missing_dependency():
+    tree_viz = TreeViz(gen_df(), calculations={'calculation': lambda df: df.unknown * 2})
+
+    with pytest.raises(KeyError):
+        tree_viz.tree
+
+
+def test_snapshot_matches_one_tree_per_snapshot():
+    df = pd.concat([gen_df().assign(week='week 1'),
+                    gen_wide_df().rename(columns={'source': 'impression'}).assign(week='week 2')])
+    columns = ['users', 'conversions', 'conversion_rate']
+
+    tree_viz = TreeViz(df, calculations=gen_calculations(), snapshot_by='week')
+    assert tree_viz.node_level_list == ['impression', 'click']
+    assert tree_viz.metrics == ['users', 'conversions']
+    assert tree_to_dict(tree_viz.tree, columns) == \
+        tree_to_dict(TreeViz(df.drop(columns='week'), calculations=gen_calculations()).tree, columns)
+
+    assert tree_viz.snapshot_list == ['week 1', 'week 2']
+    for i, week in enumerate(tree_viz.snapshot_list):
+        expected = tree_to_dict(
+            TreeViz(df[df.week == week].drop(columns='week'), calculations=gen_calculations()).tree,
+            columns)
+        for node in PreOrderIter(tree_viz.tree):
+            actual = tuple(float(node.snapshot_values[column][i]) for column in columns)
+            if node.name in expected:
+                assert actual == pytest.approx(expected[node.name])
+            else:
+                assert actual[:2] == (0, 0)
+
+
+def test_snapshot_label():
+    df = pd.concat([gen_df().assign(week=1), gen_df().assign(week=2)])
+    df.loc[df.week == 2, 'users'] *= 2
+
+    tree_viz = TreeViz(df, snapshot_by='week', base_snapshot=1)
+    tree_viz.update_node_metric_col_print_dict({'users': {'type': 'int', 'digits': 0}})
+
+    assert tree_viz.get_snapshot_delta(tree_viz.tree, 'users', 2) == 411000
+    assert tree_viz.get_snapshot_ratio(tree_viz.tree, 'users', 2) == 2
+    assert tree_viz._default_node_label_func(tree_viz.tree) == \
+        'label="Total\n-----------\nusers: 1,233,000\n  1: 411,000\n  2: 822,000 (+411,000, x2.00)"'
+
+
+def test_from_chunks_matches_in_memory():
+    df = gen_large_df(n_row=2000)
+    columns = ['users', 'conversions', 'conversion_rate']
+    chunks = (df.iloc[i:i + 300] for i in range(0, len(df), 300))
+
+    tree_viz = TreeViz.from_chunks(chunks, processes=2, calculations=gen_calculations())
+    expected = TreeViz(df, calculations=gen_calculations())
+
+    assert tree_viz.node_level_list == expected.node_level_list
+    assert tree_viz.df.equals(expected.df)
+    assert tree_to_dict(tree_viz.tree, columns) == tree_to_dict(expected.tree, columns)
+
+
+def test_from_file_csv(tmp_path):
+    df = pd.concat([gen_df().assign(week='week 1'), gen_df().assign(week='week 2')])
+    filepath = str(tmp_path / 'funnel.csv')
+    df.to_csv(filepath, index=False)
+
+    tree_viz = TreeViz.from_file(filepath, chunksize=3, processes=1, snapshot_by='week')
+    expected = TreeViz(df, snapshot_by='week')
+
+    assert tree_to_dict(tree_viz.tree, ['users']) == tree_to_dict(expected.tree, ['users'])
+    assert (tree_viz.tree.snapshot_values['users'] == [411000, 411000]).all()
+
+
+def test_node_table_cache_without_aggregation(tmp_path, monkeypatch):
+    # One entry per configuration, the DataFrame and the file would replace each other's
+    cache_dir, file_cache_dir = str(tmp_path / 'cache'), str(tmp_path / 'file_cache')
+    df = pd.concat([gen_df().assign(week='week 1'), gen_df().assign(week='week 2')])
+    filepath = str(tmp_path / 'funnel.csv')
+    df.to_csv(filepath, index=False)
+    expected = tree_to_dict(TreeViz(df, snapshot_by='week').tree, ['users'])
+
+    TreeViz(df, snapshot_by='week', cache_dir=cache_dir).to_dot()
+    TreeViz.from_file(filepath, processes=1, snapshot_by='week', cache_dir=file_cache_dir).to_dot()
+
+    # The entries are fresh, the data is neither read nor aggregated
+    def fail(*args, **kwargs):
+        raise AssertionError("The data should not be aggregated")
+    monkeypatch.setattr(funnel_viz, 'aggregate_chunks', fail)
+    monkeypatch.setattr(funnel_viz, '_read_file_chunks', fail)
+    tree_viz = TreeViz(df, snapshot_by='week', cache_dir=cache_dir)
+    assert tree_to_dict(tree_viz.tree, ['users']) == expected
+    tree_viz = TreeViz.from_file(filepath, node_level_list=['impression', 'click'],
+                                 metrics=['users', 'conversions'], snapshot_by='week',
+                                 cache_dir=file_cache_dir)
+    assert tree_to_dict(tree_viz.tree, ['users']) == expected
+    assert tree_viz.snapshot_list == ['week 1', 'week 2']
+
+    # base_snapshot is checked against the snapshots of the entry
+    tree_viz = TreeViz.from_file(filepath, node_level_list=['impression', 'click'],
+                                 metrics=['users', 'conversions'], snapshot_by='week',
+                                 base_snapshot='week 3', cache_dir=file_cache_dir)
+    with pytest.raises(ValueError):
+        tree_viz.tree
+    monkeypatch.undo()
+
+    # Another file content is another entry
+    df.loc[df.week == 'week 2', 'users'] *= 10
+    df.to_csv(filepath, index=False)
+    tree_viz = TreeViz.from_file(filepath, processes=1, snapshot_by='week',
+                                 cache_dir=file_cache_dir)
+    assert tree_viz.tree.users == 411000 * 11
+
+
+def test_gen_funnel_df():
+    df = gen_funnel_df(depth=4, fan_out=3, n_metric=5, n_row=1000)
+
+    assert df.shape == (1000, 9)
+    assert df.level_0.nunique() == 3
+    assert TreeViz(df).node_level_list == ['level_0', 'level_1', 'level_2', 'level_3']
+
+
+def test_run_benchmark():
+    df_result = run_benchmark(fan_out_list=(2, 3), n_calculation_list=(3,), n_row_list=(200,),
+                              repeat=1)
+
+    assert df_result.n_node.tolist() == [1 + 2 + 4 + 8, 1 + 3 + 9 + 27]
+    assert (df_result[STAGE_LIST + ['peak_memory_mb']] > 0).all().all()
+    assert sorted(get_scaling_exponent(df_result)) == sorted(STAGE_LIST)
+
+
+def test_to_plotly():
+    tree_viz = TreeViz(gen_df(), calculations=gen_calculations())
+    figure = tree_viz.to_plotly('icicle', color_metric='conversion_rate')
+    trace = figure.data[0]
+
+    assert trace.type == 'icicle'
+    assert list(trace.ids) == [node.name for node in PreOrderIter(tree_viz.tree)]
+    assert list(trace.parents) == ['', 'root', 'root->Impression', 'root->Impression',
+                                   'root', 'root->No Impression', 'root->No Impression']
+    assert list(trace.labels) == [node.node_name_print for node in PreOrderIter(tree_viz.tree)]
+    assert list(trace.values) == [node.users for node in PreOrderIter(tree_viz.tree)]
+    assert trace.hovertemplate == '<b>%{label}</b><br>users: %{customdata[0]:,}' \
+                                  '<br>conversions: %{customdata[1]:,}' \
+                                  '<br>conversion rate: %{customdata[2]:,.2f}<extra></extra>'
+
+    with pytest.raises(ValueError):
+        tree_viz.to_plotly('pie')
+
+
+def test_to_html(tmp_path):
+    filepath = str(tmp_path / 'funnel.html')
+    TreeViz(gen_large_df(n_row=1000), top_k=3).to_html(filepath, kind='treemap')
+
+    with open(filepath) as html_file:
+        html = html_file.read()
+    assert 'cdn.plot.ly' in html
+    assert len(html) < 100000
+
+
+def test_node_table_cache(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    df = pd.concat([gen_df().assign(week=1), gen_df().assign(week=2)])
+    columns = ['users', 'conversions', 'conversion_rate']
+    expected = TreeViz(df, calculations=gen_calculations(), snapshot_by='week')
+
+    tree_viz = TreeViz(df, calculations=gen_calculations(), snapshot_by='week', cache_dir=cache_dir)
+    assert tree_to_dict(tree_viz.tree, columns) == tree_to_dict(expected.tree, columns)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The node table should be loaded from the cache")
+    monkeypatch.setattr(TreeViz, '_get_all_node_df', fail)
+
+    cached_tree_viz = TreeViz(df, calculations=gen_calculations(), snapshot_by='week',
+                              cache_dir=cache_dir)
+    assert tree_to_dict(cached_tree_viz.tree, columns) == tree_to_dict(expected.tree, columns)
+    assert cached_tree_viz.snapshot_list == [1, 2]
+    assert (cached_tree_viz.tree.snapshot_values['users'] == [411000, 411000]).all()
+    monkeypatch.undo()
+
+    # The table without snapshot used by to_plotly doesn't reset snapshot_list
+    cached_tree_viz.to_plotly()
+    cached_tree_viz = TreeViz(df, calculations=gen_calculations(), snapshot_by='week',
+                              cache_dir=cache_dir)
+    cached_tree_viz.tree
+    cached_tree_viz.to_plotly()
+    assert cached_tree_viz.snapshot_list == [1, 2]
+    assert cached_tree_viz.to_dot() == expected.to_dot()
+
+    # Stale entries: other data or other calculation code
+    df.loc[df.week == 2, 'users'] *= 2
+    stale_tree_viz = TreeViz(df, calculations=gen_calculations(), snapshot_by='week',
+                             cache_dir=cache_dir)
+    assert stale_tree_viz.tree.users == 411000 * 3
+
+    calculations = {'conversion_rate': lambda df: df.conversions / df.users * 100}
+    stale_tree_viz = TreeViz(df, calculations=calculations, snapshot_by='week', cache_dir=cache_dir)
+    assert stale_tree_viz.tree.conversion_rate == pytest.approx(6190 * 2 / (411000 * 3) * 100)
+
+
+def test_node_table_cache_closure(tmp_path):
+    # The factor is in the closure of the calculation, not in its code
+    def gen_scaled(factor):
+        return {'scaled': lambda df: df.users * factor}
+
+    tree_viz = TreeViz(gen_df(), calculations=gen_scaled(1), cache_dir=str(tmp_path))
+    assert tree_viz.tree.scaled == 411000
+    tree_viz = TreeViz(gen_df(), calculations=gen_scaled(100), cache_dir=str(tmp_path))
+    assert tree_viz.tree.scaled == 41100000
+
+    # Calculations that can't be hashed don't use the cache
+    class Scale(object):
+        def __call__(self, df):
+            return df.users * 2
+    tree_viz = TreeViz(gen_df(), calculations={'scaled': Scale()}, cache_dir=str(tmp_path))
+    assert tree_viz.fingerprint is None
+    assert tree_viz.tree.scaled == 411000 * 2
+
+
+def test_fingerprint_nested_code():
+    # A generator expression is a code object nested in the code of the calculation,
+    # the fingerprint must not depend on its address
+    source = "calculations = {'total': lambda df: sum(df[column] for column in column_list)}"
+    script = ("import pandas as pd\n"
+              "from funnel_tree_vis.funnel_viz import TreeViz\n"
+              "namespace = {{'column_list': ['users', 'conversions']}}\n"
+              "exec({source!r}, namespace)\n"
+              "df = pd.DataFrame({{'step': ['a', 'b'], 'users': [1, 2], 'conversions': [0, 1]}})\n"
+              "print(TreeViz(df, calculations=namespace['calculations']).fingerprint)\n"
+              ).format(source=source)
+    fingerprint_list = [subprocess.check_output([sys.executable, '-c', script]).strip()
+                        for _ in range(2)]
+    assert fingerprint_list[0] != b'None'
+    assert fingerprint_list[0] == fingerprint_list[1]
+
+    namespace = {'column_list': ['users', 'conversions']}
+    exec(source, namespace)
+    df = pd.DataFrame({'step': ['a', 'b'], 'users': [1, 2], 'conversions': [0, 1]})
+    fingerprint = TreeViz(df, calculations=namespace['calculations']).fingerprint
+    namespace['column_list'] = ['users']
+    assert TreeViz(df, calculations=namespace['calculations']).fingerprint != fingerprint
+
+
+def test_node_table_cache_dtype(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    df = pd.concat([gen_df().assign(week=pd.Timestamp('2024-01-01')),
+                    gen_df().assign(week=pd.Timestamp('2024-01-08'))])
+    expected = TreeViz(df, snapshot_by='week')
+    expected_df_all_node = expected._get_all_node_df(snapshot_by='week')
+    expected_dict = tree_to_dict(expected.tree, ['users'])
+
+    TreeViz(df, snapshot_by='week', cache_dir=cache_dir).tree
+    assert len(os.listdir(cache_dir)) == 1
+
+    monkeypatch.setattr(TreeViz, '_get_all_node_df', lambda *args, **kwargs: 1 / 0)
+    cached_tree_viz = TreeViz(df, snapshot_by='week', cache_dir=cache_dir)
+    df_all_node = cached_tree_viz._get_cached_all_node_df(snapshot_by='week')
+    assert cached_tree_viz.snapshot_list == [pd.Timestamp('2024-01-01'),
+                                             pd.Timestamp('2024-01-08')]
+    pd.testing.assert_frame_equal(df_all_node, expected_df_all_node, check_dtype=False)
+    assert (df_all_node.dtypes.drop('node_name') ==
+            expected_df_all_node.dtypes.drop('node_name')).all()
+    assert tree_to_dict(cached_tree_viz.tree, ['users']) == expected_dict
+
+    # The numeric columns are not copied out of the .npy files
+    array = df_all_node['users'].values
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    assert array is not None
+
+
+def test_save_node_table(tmp_path):
+    cache_path = str(tmp_path / 'entry')
+    df = pd.DataFrame({'node_name': ['root', 'root->a', 'root->b'],
+                       'users': [3, 1, 2],
+                       'segment': pd.Categorical(['x', 'y', 'x'], categories=['y', 'x'],
+                                                 ordered=True),
+                       'day': pd.date_range('2024-01-01', periods=3, tz='Europe/Paris')})
+    assert funnel_viz.save_node_table(df, cache_path, {'fingerprint': 'a'})
+    assert funnel_viz.save_node_table(df.assign(users=[30, 10, 20]), cache_path, {'fingerprint': 'b'})
+    assert os.listdir(str(tmp_path)) == ['entry']
+
+    assert funnel_viz.load_node_table(cache_path, 'a') == (None, None)
+    df_loaded, metadata = funnel_viz.load_node_table(cache_path, 'b')
+    pd.testing.assert_frame_equal(df_loaded, df.assign(users=[30, 10, 20]), check_dtype=False)
+    assert df_loaded['segment'].dtype == df['segment'].dtype
+    assert df_loaded['day'].dtype == df['day'].dtype
+    assert (np.load(os.path.join(cache_path, 'parent_id.npy')) == [-1, 0, 0]).all()
+
+    # Columns of python objects are not saved
+    assert not funnel_viz.save_node_table(df.assign(users=[{}, {}, {}]), str(tmp_path / 'other'),
+                                          {})
+    assert os.listdir(str(tmp_path)) == ['entry']
+
+
+def test_lazy_tree():
+    df = pd.concat([gen_large_df(n_row=2000).assign(week='week 1'),
+                    gen_large_df(n_row=1000).assign(week='week 2')])
+    df.loc[df.level_0 == '1', 'level_0'] = '1 b'
+    columns = ['users', 'conversions', 'conversion_rate']
+
+    tree_viz = TreeViz(df, calculations=gen_calculations(), snapshot_by='week', lazy_depth=1)
+    expected = TreeViz(df, calculations=gen_calculations(), snapshot_by='week')
+
+    dot = tree_viz.to_dot()
+    assert dot.count(' -> ') == 8
+    assert tree_viz.to_dot() == dot
+
+    node = tree_viz.expand('root->1 b->3')
+    assert node.users == tree_to_dict(expected.tree, ['users'])['root->1 b->3'][0]
+    assert tree_viz.to_dot().count(' -> ') == 8 + 8
+    assert not node.is_expanded
+    assert not node.children[0].is_expanded
+    assert tree_viz.to_dot().count(' -> ') == 8 + 8 + 8
+
+    # Accessing every children expands the whole tree
+    assert tree_to_dict(tree_viz.tree, columns) == tree_to_dict(expected.tree, columns)
+    expected_node_dict = {node.name: node for node in PreOrderIter(expected.tree)}
+    for node in PreOrderIter(tree_viz.tree):
+        assert [child.name for child in node.children] == \
+            [child.name for child in expected_node_dict[node.name].children]
+        assert (node.snapshot_values['users'] ==
+                expected_node_dict[node.name].snapshot_values['users']).all()
+
+    with pytest.raises(KeyError):
+        tree_viz.expand('root->unknown')
+
+
+def test_update_numeric_level():
+    df = pd.DataFrame({'step': [1, 1, 2], 'variant': [10, 20, 10], 'users': [5, 6, 7]})
+    df_delta = pd.DataFrame({'step': [1, 3], 'variant': [10, 30], 'users': [1, 2]})
+
+    tree_viz = TreeViz(df, node_level_list=['step', 'variant'], metrics=['users'])
+    tree_viz.tree
+    tree_viz.update(df_delta)
+
+    expected = TreeViz(pd.concat([df, df_delta]), node_level_list=['step', 'variant'],
+                       metrics=['users'])
+    assert tree_to_dict(tree_viz.tree, ['users']) == tree_to_dict(expected.tree, ['users'])
+    assert tree_to_dict(tree_viz.tree, ['users'])['root->3->30'] == (2,)
+
+
+def test_prune_other_name_collision():
+    df = pd.DataFrame({'source': ['A', 'B', 'Other', 'C', 'D'], 'users': [50, 40, 30, 2, 1]})
+
+    with pytest.raises(ValueError):
+        TreeViz(df, top_k=3).tree
+
+    tree_viz = TreeViz(df, top_k=3, other_name='Rest')
+    assert tree_to_dict(tree_viz.tree, ['users']) == \
+        {'root': (123,), 'root->A': (50,), 'root->B': (40,), 'root->Other': (30,),
+         'root->Rest': (3,)}
+
+    # A real 'Other' is fine where nothing is folded
+    assert len(list(PreOrderIter(TreeViz(df, top_k=5).tree))) == 6
+
+
+def test_prune_numeric_level():
+    df = pd.DataFrame({'step': [1, 2, 3, 4], 'users': [50, 40, 2, 1]})
+    tree_viz = TreeViz(df, node_level_list=['step'], metrics=['users'], top_k=2)
+
+    assert tree_to_dict(tree_viz.tree, ['users']) == \
+        {'root': (93,), 'root->1': (50,), 'root->2': (40,), 'root->Other': (3,)}
+
+
+class FakeDotPopen(object):
+    """
+    Stand-in for the dot process: the output is the format followed by the dotprogram
+    """
+    def __init__(self, cmd, stdin=None, stdout=None, stderr=None):
+        assert stdin == subprocess.PIPE and stdout == subprocess.PIPE
+        self.cmd = cmd
+        self.returncode = None
+
+    def communicate(self, input=None):
+        fileformat = self.cmd[1][len('-T'):]
+        if fileformat == 'unknown':
+            self.returncode = 1
+            return b'', b'Format: "unknown" not recognized'
+        self.returncode = 0
+        return fileformat.encode('utf-8') + b'\n' + input, b''
+
+
+def test_render_dot(monkeypatch):
+    monkeypatch.setattr(funnel_viz.subprocess, 'Popen', FakeDotPopen)
+
+    assert render_dot('digraph tree {}', 'svg') == b'svg\ndigraph tree {}'
+    assert render_dot('digraph tree {}', 'jpg') == b'jpg\ndigraph tree {}'
+
+    with pytest.raises(subprocess.CalledProcessError):
+        render_dot('digraph tree {}', 'unknown')
+    with pytest.raises(ValueError):
+        render_dot('digraph tree {}', '')
+
+
+def test_plot_tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(funnel_viz.subprocess, 'Popen', FakeDotPopen)
+    tree_viz = TreeViz(gen_df())
+
+    for fileformat in ['png', 'pdf', 'gif']:
+        filepath = str(tmp_path / 'funnel.{}'.format(fileformat))
+        dot_source = tree_viz.plot_tree(filepath)
+        with open(filepath, 'rb') as picture_file:
+            assert picture_file.read() == fileformat.encode('utf-8') + b'\n' + \
+                dot_source.encode('utf-8')
+
+    with pytest.raises(ValueError):
+        save_dot(dot_source, str(tmp_path / 'funnel'))
+
+
+def test_plot_trees(tmp_path, monkeypatch):
+    # The workers must inherit the patched Popen
+    monkeypatch.setattr(funnel_viz.subprocess, 'Popen', FakeDotPopen)
+    monkeypatch.setattr(funnel_viz, 'Pool', multiprocessing.get_context('fork').Pool)
+    tree_viz_list = [TreeViz(gen_df()), TreeViz(gen_wide_df())]
+    filepath_list = [str(tmp_path / 'funnel.svg'), str(tmp_path / 'wide.png')]
+
+    dot_source_list = plot_trees(tree_viz_list, filepath_list, processes=2, edge_prop_metric='users')
+
+    assert dot_source_list == [tree_viz.to_dot(edge_prop_metric='users')
+                               for tree_viz in tree_viz_list]
+    for filepath, dot_source, fileformat in zip(filepath_list, dot_source_list, [b'svg', b'png']):
+        with open(filepath, 'rb') as picture_file:
+            assert picture_file.read() == fileformat + b'\n' + dot_source.encode('utf-8')
+
+    with pytest.raises(ValueError):
+        plot_trees(tree_viz_list, filepath_list[:1])
+
+
+def test_snapshot_missing_value():
+    df = pd.DataFrame({'step': ['a', 'a', 'b'], 'week': ['w1', 'w2', None], 'users': [1, 2, 4]})
+
+    with pytest.raises(ValueError):
+        TreeViz(df, snapshot_by='week')
+    with pytest.raises(ValueError):
+        TreeViz.from_chunks([df.iloc[:2], df.iloc[2:]], processes=1, snapshot_by='week')
+
+    tree_viz = TreeViz(df.iloc[:2], snapshot_by='week')
+    with pytest.raises(ValueError):
+        tree_viz.update(df.iloc[2:])
+
+
+def test_snapshot_unknown_base_snapshot():
+    df = pd.DataFrame({'step': ['a', 'a'], 'week': ['w1', 'w2'], 'users': [1, 2]})
+
+    with pytest.raises(ValueError):
+        TreeViz(df, snapshot_by='week', base_snapshot='w9')
+    with pytest.raises(ValueError):
+        TreeViz(df, base_snapshot='w1')
+    assert TreeViz(df, snapshot_by='week', base_snapshot='w2').tree.users == 3
+
+
+def test_to_plotly_value_metric():
+    tree_viz = TreeViz(gen_df(), calculations=gen_calculations())
+
+    assert list(tree_viz.to_plotly(value_metric='conversions').data[0].values)[0] == 6190
+    with pytest.raises(ValueError):
+        tree_viz.to_plotly(value_metric='conversion_rate')
+
+
+def test_zero_parent_metric():
+    df = gen_df()
+    df.loc[df.impression == 'No Impression', 'conversions'] = 0
+    tree_viz = TreeViz(df, calculations=gen_calculations())
+
+    # The metrics are numpy values, a ratio on a zero parent is nan instead of an error
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dot = tree_viz.to_dot(edge_prop_metric='conversions')
+    assert 'nan%' in dot
+    assert isinstance(tree_viz.tree.conversions, np.generic)
+
+    tree_viz.update(df.assign(impression='New Impression'))
+    node = tree_viz.expand('root->New Impression->Click')
+    assert isinstance(node.conversions, np.generic)
+    assert isinstance(node.conversion_rate, np.generic)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        assert 'nan%' in tree_viz.to_dot(edge_prop_metric='conversions')